@@ -1,20 +1,36 @@
 import os
-import re
+import threading
 
-non_alphanum_regexpr = re.compile(r"[^a-zA-Z\d]")
+non_alphanum_regexpr = None  # compiled on first use, see sanitize_name
 
 
 def sanitize_name(name):
     """Return the name with all non-alphanumerics replaced by '_'. """
+    global non_alphanum_regexpr
+    if non_alphanum_regexpr is None:
+        import re
+
+        non_alphanum_regexpr = re.compile(r"[^a-zA-Z\d]")
     if name[0] in "0123456789":
         name = "_" + name
-    return re.sub(non_alphanum_regexpr, "_", name)
+    return non_alphanum_regexpr.sub("_", name)
+
+
+def human_size(nbytes):
+    """Return a size in bytes as a short string, e.g. '12.3 kB'."""
+    if nbytes < 1000:
+        return "%d B" % nbytes
+    for unit in ["kB", "MB", "GB", "TB"]:
+        nbytes /= 1000.0
+        if nbytes < 1000:
+            break
+    return "%.1f %s" % (nbytes, unit)
 
 
 class FileTreeElement:
     """Base class for Directories and Files."""
 
-    def __init__(self, location=".", name=None, file_manager=None):
+    def __init__(self, location=".", name=None, file_manager=None, explore=True):
 
         # Initialize the properties and the files manager
         self._name = name
@@ -27,20 +43,55 @@ class FileTreeElement:
 
         # Automatically explore the folder and subfolders to build a tree
         if self._is_dir:
+            if name is None:
+                self._lock = threading.RLock()  # see Directory._refresh
+            else:
+                self._lock = location._lock
+            self._mtime = self._file_manager.mtime(self)
             self._dict = {}
             self._files = []
             self._dirs = []
-            for filename in self._file_manager.list_files(self):
-                self._file(filename, replace=False)
-            for dirname in self._file_manager.list_dirs(self):
-                self._dir(dirname, replace=False)
+            self._listings = {}  # sorted entries served by _list
+            self._listings_mtime = self._mtime
+            self._sizes = {}  # cached totals of _du, by value of compressed
+            if explore:
+                for filename in self._file_manager.list_files(self):
+                    self._file(filename, replace=False)
+                for dirname in self._file_manager.list_dirs(self):
+                    self._dir(dirname, replace=False)
 
-    def _close(self):
-        """Close the file manager."""
-        return self._file_manager.close()
-
-    def __exit__(self, *a):
-        """Exit and close the file manager."""
+    @property
+    def _root(self):
+        """Root directory of the tree this element belongs to."""
+        element = self
+        while not isinstance(element._location, str):
+            element = element._location
+        return element
+
+    def _close(self, **kw):
+        """Close the file manager.
+
+        For in-memory zip archives, this returns the zip data. Keyword
+        arguments are passed to the file manager's ``close`` method, e.g.
+        ``as_memoryview=True`` or ``target=stream`` to avoid copying the data.
+        """
+        return self._file_manager.close(**kw)
+
+    def _commit(self, **kw):
+        """Commit the pending changes of the file manager, e.g. write the
+        changes of an overlay tree into a new archive (keyword arguments are
+        passed to the file manager's ``commit`` method)."""
+        return self._file_manager.commit(**kw)
+
+    def __exit__(self, exc_type, *a):
+        """Exit and close the file manager.
+
+        On errors, files still open in atomic mode are discarded rather than
+        replacing their targets (see ``DiskFileManager``)."""
+        if (exc_type is not None) and hasattr(
+            self._file_manager, "discard_open_files"
+        ):
+            self._file_manager.discard_open_files()
         self._close()
 
     def __enter__(self):
@@ -76,27 +127,186 @@ class Directory(FileTreeElement):
         subdir = Directory(location=self, name=name, file_manager=self._file_manager)
         # From here we create
         self._file_manager.create(subdir, replace=replace)
-        self._dirs.append(subdir)
-        self._dict[name] = subdir
-        self.__dict__[sanitize_name(subdir._name)] = subdir
-        return subdir
+        self._listings.clear()
+        return self._register(subdir)
 
     def _file(self, name, replace=True):
         """Create a new file or overwrite an existing one."""
-        if name in self._dict:
+        is_registered = name in self._dict
+        if is_registered:
             f = self[name]
-            if replace:
-                f.delete()
-            else:
+            if not replace:
                 return f
+            if not getattr(self._file_manager, "atomic", False):
+                # In atomic mode the file keeps its content until it is
+                # written again, so the content survives an error before that.
+                f.delete()
+                is_registered = False
         else:
             f = File(location=self, name=name, file_manager=self._file_manager)
         # From here we create
         self._file_manager.create(f, replace=replace)
-        self._files.append(f)
-        self._dict[f._name] = f
-        self.__dict__[sanitize_name(f._name)] = f
-        return f
+        self._listings.clear()
+        recorder = self._file_manager.hash_recorder
+        if replace and (recorder is not None):
+            recorder.start(f)  # The file is now empty
+        if is_registered:
+            self._invalidate_sizes()
+            return f
+        return self._register(f)
+
+    def _register(self, element):
+        """Add a file or subdirectory to this directory's records (but not to
+        the file system) and return it."""
+        with self._lock:
+            if element._is_dir:
+                self._dirs.append(element)
+            else:
+                self._files.append(element)
+            self._dict[element._name] = element
+            self.__dict__[sanitize_name(element._name)] = element
+        self._invalidate_sizes()
+        return element
+
+    def _element_at(self, path):
+        """Return the file or directory at the given '/'-separated path
+        relative to this directory.
+
+        Elements missing from the tree (for instance in trees opened with
+        ``explore=False``) are added to it without exploring the file system.
+        """
+        element = self
+        parts = path.split("/")
+        for i, part in enumerate(parts):
+            if part not in element._dict:
+                is_dir = i < len(parts) - 1
+                element._register(
+                    (Directory if is_dir else File)(
+                        location=element,
+                        name=part,
+                        file_manager=self._file_manager,
+                        explore=False,
+                    )
+                )
+            element = element._dict[part]
+        return element
+
+    def _list(
+        self, offset=0, limit=None, sort_by="name", pattern=None, reverse=False
+    ):
+        """Return a page of the files and subdirectories of this directory,
+        subdirectories first.
+
+        This is meant for directories with a very large number of entries,
+        opened with ``file_tree(target, explore=False)``: the entries are
+        listed and sorted once per sorting criterion (and again only if the
+        directory changes) as lightweight tuples, and File and Directory
+        objects (non-explored) are only created for the entries of the page
+        requested. Only the last filtered (or reversed) listing is kept, so
+        that different patterns don't accumulate copies of the listing.
+
+        Parameters
+        ----------
+
+        offset, limit
+          Index of the first entry of the page, and maximal number of entries
+          in the page (default None for all remaining entries).
+
+        sort_by
+          Either "name", "size" or "mtime".
+
+        pattern
+          Pattern such as "*.csv". Only the entries whose names match the
+          pattern are listed.
+
+        reverse
+          If True, the entries are sorted in decreasing order.
+        """
+        if sort_by not in ("name", "size", "mtime"):
+            raise ValueError("sort_by should be 'name', 'size' or 'mtime'.")
+        with self._lock:
+            mtime = self._file_manager.mtime(self)
+            if mtime != self._listings_mtime:
+                self._listings_mtime = mtime
+                self._listings.clear()
+            if sort_by not in self._listings:
+                self._listings[sort_by] = self._sorted_entries(sort_by)
+            entries = self._listings[sort_by]
+            if (pattern is not None) or reverse:
+                key = (sort_by, pattern, reverse)
+                if key not in self._listings:
+                    for other_key in [k for k in self._listings if k != sort_by]:
+                        if isinstance(other_key, tuple):
+                            self._listings.pop(other_key)
+                    self._listings[key] = self._filtered_entries(
+                        entries, pattern, reverse
+                    )
+                entries = self._listings[key]
+            end = None if limit is None else offset + limit
+            page = []
+            for name, is_dir, _, _ in entries[offset:end]:
+                element = self._dict.get(name, None)
+                if element is None:
+                    element_class = Directory if is_dir else File
+                    element = self._register(
+                        element_class(
+                            location=self,
+                            name=name,
+                            file_manager=self._file_manager,
+                            explore=False,
+                        )
+                    )
+                page.append(element)
+            return page
+
+    def _sorted_entries(self, sort_by="name"):
+        """Return the sorted ``(name, is_dir, size, mtime)`` of the entries of
+        the directory, as listed by the file manager."""
+        with_stats = sort_by != "name"
+        if hasattr(self._file_manager, "list_entries"):
+            entries = self._file_manager.list_entries(self, with_stats=with_stats)
+        elif with_stats:
+            raise NotImplementedError(
+                "This file manager can only list entries sorted by name."
+            )
+        else:
+            entries = [
+                (name, is_dir, None, None)
+                for (is_dir, names) in [
+                    (False, self._file_manager.list_files(self)),
+                    (True, self._file_manager.list_dirs(self)),
+                ]
+                for name in names
+            ]
+        # Elements created in the tree but not yet visible to the file manager
+        # (e.g. files not yet flushed into a zip archive)
+        listed = set(name for (name, _, _, _) in entries)
+        with self._lock:
+            elements = list(self._dict.items())
+        for name, element in elements:
+            if name not in listed:
+                size = None
+                if with_stats and not element._is_dir:
+                    size = self._file_manager.file_size(element)
+                entries.append((name, element._is_dir, size, None))
+        stat_index = {"name": 0, "size": 2, "mtime": 3}[sort_by]
+        entries.sort(key=lambda e: (e[stat_index] or 0, e[0]))
+        entries.sort(key=lambda e: not e[1])  # stable: subdirectories first
+        return entries
+
+    @staticmethod
+    def _filtered_entries(entries, pattern=None, reverse=False):
+        """Return the sorted entries whose names match the pattern, in
+        reverse order (subdirectories still first) if ``reverse`` is True."""
+        if pattern is not None:
+            from fnmatch import fnmatchcase
+
+            entries = [e for e in entries if fnmatchcase(e[0], pattern)]
+        if reverse:
+            dirs_count = sum(1 for e in entries if e[1])
+            dirs, files = entries[:dirs_count], entries[dirs_count:]
+            entries = dirs[::-1] + files[::-1]
+        return entries
 
     @property
     def _filenames(self):
@@ -111,20 +321,149 @@ class Directory(FileTreeElement):
     @property
     def _all_files(self):
         """Return a list of all file objects in that tree."""
-        return self._files + sum([d._all_files for d in self._dirs], [])
+        return list(self._iter_files())
+
+    def _iter_files(self):
+        """Iterate over all file objects in that tree."""
+        for f in self._files:
+            yield f
+        for subdir in self._dirs:
+            for f in subdir._iter_files():
+                yield f
+
+    def _map(self, func, pattern=None, workers=4, executor="thread"):
+        """Apply ``func`` to all files of the tree in parallel, and yield the
+        results as they are completed (not necessarily in order).
+
+        Parameters
+        ----------
 
-    def _tree_view(self, indent_size=2, indent_level=0, as_lines=False):
+        func
+          Function ``func(f)`` of a flametree File. For process executors the
+          function must be picklable (e.g. defined at the module level).
+
+        pattern
+          Pattern such as "*.csv" or "data/*.txt". Only the files whose path
+          relative to this directory matches the pattern are processed.
+
+        workers
+          Number of parallel threads or processes. No more than twice this
+          number of files are submitted at any time, so that the results
+          don't accumulate in memory if they are consumed slowly.
+
+        executor
+          Either "thread" or "process". Processes receive FileHandles and
+          reopen the tree only once per process (see ``FileHandle``).
+        """
+        from concurrent import futures
+        from fnmatch import fnmatchcase
+
+        files = self._iter_files()
+        if pattern is not None:
+            files = (f for f in files if fnmatchcase(self._relative_path(f), pattern))
+        if executor == "thread":
+            executor_class = futures.ThreadPoolExecutor
+            executor_options = {}
+            tasks = ((func, f) for f in files)
+        elif executor == "process":
+            from .FileHandle import FileHandle, apply_to_file, forget_roots
+
+            executor_class = futures.ProcessPoolExecutor
+            executor_options = dict(initializer=forget_roots)
+            spec, root = self._file_manager.handle_spec(), self._root
+            tasks = (
+                (apply_to_file, func, FileHandle(spec, root._relative_path(f)))
+                for f in files
+            )
+        else:
+            raise ValueError("executor should be 'thread' or 'process'.")
+        with executor_class(workers, **executor_options) as pool:
+            pending = set()
+            for task in tasks:
+                pending.add(pool.submit(*task))
+                if len(pending) >= 2 * workers:
+                    done, pending = futures.wait(
+                        pending, return_when=futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        yield future.result()
+            for future in futures.as_completed(pending):
+                yield future.result()
+
+    def _relative_path(self, element):
+        """Return the path of an element relative to this directory, with
+        '/' as a separator."""
+        path = element._path[len(self._path) :].lstrip("/" + os.sep)
+        return path.replace(os.sep, "/")
+
+    def _manifest(self, algo="md5", workers=1, as_text=False):
+        """Return the hashes of all files in the directory's subtree.
+
+        The result is a dict ``{relative_path: hexdigest}`` sorted by path,
+        or if ``as_text`` is True a string in the format of ``md5sum``-like
+        tools (one "digest  path" line per file). With ``workers > 1``, the
+        files are hashed in parallel threads.
+        """
+        files = sorted(self._all_files, key=self._relative_path)
+        if workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(workers) as executor:
+                digests = list(executor.map(lambda f: f._hash(algo), files))
+        else:
+            digests = [f._hash(algo) for f in files]
+        manifest = {self._relative_path(f): d for (f, d) in zip(files, digests)}
+        if as_text:
+            return "".join(
+                "%s  %s\n" % (digest, path) for (path, digest) in manifest.items()
+            )
+        return manifest
+
+    def _du(self, compressed=False):
+        """Return the total size in bytes of all files in that tree.
+
+        If ``compressed`` is True, the compressed sizes of zipped files are
+        used. Sizes come from the file manager's cached metadata (directory
+        listings, zip archive records) and no file is read. The total of each
+        directory is computed once, until files are written or deleted in its
+        subtree.
+        """
+        if compressed not in self._sizes:
+            self._sizes[compressed] = sum(
+                f._file_manager.file_size(f, compressed) for f in self._files
+            ) + sum(subdir._du(compressed=compressed) for subdir in self._dirs)
+        return self._sizes[compressed]
+
+    def _invalidate_sizes(self):
+        """Forget the cached total sizes of this directory and its parents."""
+        directory = self
+        # A directory's total is only cached if its subdirectories' are.
+        while isinstance(directory, Directory) and directory._sizes:
+            directory._sizes.clear()
+            directory = directory._location
+
+    def _tree_view(
+        self, indent_size=2, indent_level=0, as_lines=False, show_sizes=False
+    ):
         """Return a string representation of the tree for pretty printing.
+
+        If ``show_sizes`` is True, the size of each file and directory is
+        indicated between parentheses.
         """
         lines = []
         space = indent_size * indent_level * " "
         for subdir in sorted(self._dirs, key=lambda subdir: subdir._name):
-            lines.append("%s%s/" % (space, subdir._name))
+            size = " (%s)" % human_size(subdir._du()) if show_sizes else ""
+            lines.append("%s%s/%s" % (space, subdir._name, size))
             lines += subdir._tree_view(
-                indent_size=indent_size, indent_level=indent_level + 1, as_lines=True
+                indent_size=indent_size,
+                indent_level=indent_level + 1,
+                as_lines=True,
+                show_sizes=show_sizes,
             )
         for f in sorted(self._files, key=lambda f: f._name):
-            lines.append("%s%s" % (space, f._name))
+            size = " (%s)" % human_size(f._size) if show_sizes else ""
+            lines.append("%s%s%s" % (space, f._name, size))
 
         return lines if as_lines else "\n".join(lines)
 
@@ -140,6 +479,14 @@ class Directory(FileTreeElement):
         self._copy(directory, replace_dirs=replace_dirs, replace_files=replace_files)
         self._delete()
 
+    def _handles(self):
+        """Return picklable FileHandles for all files in the tree."""
+        from .FileHandle import FileHandle
+
+        spec = self._file_manager.handle_spec()
+        root = self._root
+        return [FileHandle(spec, root._relative_path(f)) for f in self._all_files]
+
     def _copy(self, directory, replace_dirs=True, replace_files=True):
         """Copy this directory into the specified directory.
 
@@ -161,12 +508,83 @@ class Directory(FileTreeElement):
         if isinstance(self._location, str):
             raise IOError("You can't delete the root dir with Flametree.")
         self._file_manager.delete(self)
-        location = self._location
-        location._dict.pop(self._name)
-        location.__dict__.pop(self._name, None)
-        location._dirs = [
-            subdir for subdir in location._dirs if subdir._name != self._name
-        ]
+        self._location._forget(self)
+
+    def _forget(self, element):
+        """Remove a file or subdirectory from this directory's records (but
+        not from the file system)."""
+        with self._lock:
+            self._listings.clear()
+            self._invalidate_sizes()
+            self._dict.pop(element._name)
+            self.__dict__.pop(sanitize_name(element._name), None)
+            if element._is_dir:
+                self._dirs = [d for d in self._dirs if d._name != element._name]
+            else:
+                self._files = [f for f in self._files if f._name != element._name]
+
+    def _refresh(self, recursive=True):
+        """Update the tree with the files and directories created or deleted
+        by other programs since the tree was explored.
+
+        Only the directories whose modification time changed are listed again
+        (zip archives can't be modified by other programs and are never
+        listed again). Returns a tuple ``(added, removed)`` of the lists of
+        added and removed files and directories.
+
+        The tree's records are only changed while holding ``self._lock``, a
+        reentrant lock shared by the whole tree, which can be held to read the
+        tree safely while it is refreshed by another thread (see
+        ``TreeWatcher``).
+        """
+        with self._lock:
+            added, removed = [], []
+            mtime = self._file_manager.mtime(self)
+            if (mtime is not None) and (mtime != self._mtime):
+                self._mtime = mtime
+                filenames = set(self._file_manager.list_files(self))
+                dirnames = set(self._file_manager.list_dirs(self))
+                for element in self._files + self._dirs:
+                    names = dirnames if element._is_dir else filenames
+                    if element._name not in names:
+                        self._forget(element)
+                        removed.append(element)
+                # New elements are only registered (not created with _file or
+                # _dir), as they may have been deleted since they were listed.
+                for is_dir, names, known_names in [
+                    (False, filenames, self._filenames),
+                    (True, dirnames, self._dirnames),
+                ]:
+                    for name in sorted(names.difference(known_names)):
+                        element_class = Directory if is_dir else File
+                        element = element_class(
+                            location=self, name=name, file_manager=self._file_manager
+                        )
+                        added.append(self._register(element))
+            if recursive:
+                for subdir in self._dirs:
+                    if subdir not in added:  # New directories are fully explored
+                        subdir_added, subdir_removed = subdir._refresh(recursive=True)
+                        added += subdir_added
+                        removed += subdir_removed
+            return added, removed
+
+    def _watch(
+        self, interval=1.0, callback=None, max_cpu_fraction=0.1, error_callback=None
+    ):
+        """Start and return a TreeWatcher keeping this tree up to date by
+        calling ``_refresh`` periodically, in a background thread."""
+        from .TreeWatcher import TreeWatcher
+
+        watcher = TreeWatcher(
+            self,
+            interval=interval,
+            callback=callback,
+            max_cpu_fraction=max_cpu_fraction,
+            error_callback=error_callback,
+        )
+        watcher.start()
+        return watcher
 
     def __getitem__(self, it):
         return self._dict[it]
@@ -185,6 +603,10 @@ class File(FileTreeElement):
         if hasattr(content, "decode") and not mode.endswith("b"):
             mode += "b"  # You'll thank me for this. Unless it breaks something.
         self._file_manager.write(self, content, mode=mode)
+        self._location._invalidate_sizes()
+        recorder = self._file_manager.hash_recorder
+        if recorder is not None:
+            recorder.update(self, content, mode=mode)
 
     def print_content(self):
         """Print the file's content."""
@@ -206,13 +628,62 @@ class File(FileTreeElement):
     def delete(self):
         """Delete this file"""
         self._file_manager.delete(self)
-        location = self._location
-        location._dict.pop(self._name)
-        location.__dict__.pop(self._name, None)
-        location._files = [f for f in location._files if f._name != self._name]
+        recorder = self._file_manager.hash_recorder
+        if recorder is not None:
+            recorder.discard(self)
+        self._location._forget(self)
 
     def open(self, mode="a"):
-        return self._file_manager.open(self, mode=mode)
+        handle = self._file_manager.open(self, mode=mode)
+        if mode in ("r", "rb"):
+            return handle
+        self._forget_size()
+        recorder = self._file_manager.hash_recorder
+        if recorder is not None:
+            handle = recorder.wrap(self, handle, mode=mode)
+        return WriteHandle(self, handle)
+
+    def _forget_size(self):
+        """Forget the cached sizes of the file and of its directories, e.g.
+        after it was written."""
+        invalidate = getattr(self._file_manager, "invalidate", None)
+        if invalidate is not None:
+            invalidate(self)
+        self._location._invalidate_sizes()
+
+    def _handle(self):
+        """Return a small picklable FileHandle pointing to this file, which
+        can be sent to other processes (see ``FileHandle``)."""
+        from .FileHandle import FileHandle
+
+        spec = self._file_manager.handle_spec()
+        return FileHandle(spec, self._root._relative_path(self))
+
+    def _hash(self, algo="md5"):
+        """Return the hexadecimal digest of the file's content.
+
+        ``algo`` can be "crc32" or any algorithm supported by ``hashlib``.
+        Hashes recorded while writing (see ``file_tree(hash_on_write=...)``)
+        or stored in the archive (CRC32 of zipped files) are returned
+        directly, otherwise the file is read in chunks.
+        """
+        recorder = self._file_manager.hash_recorder
+        if recorder is not None:
+            digest = recorder.get(self, algo)
+            if digest is not None:
+                return digest
+        digest = self._file_manager.stored_hash(self, algo=algo)
+        if digest is not None:
+            return digest
+        from .hashing import hash_stream
+
+        with self.open("rb") as f:
+            return hash_stream(f, algo=algo)
+
+    @property
+    def _size(self):
+        """Size of the file in bytes (uncompressed size for zipped files)."""
+        return self._file_manager.file_size(self)
 
     @property
     def _name_no_extension(self):
@@ -231,3 +702,42 @@ class File(FileTreeElement):
 
     def __lt__(self, other):
         return self._path < other._path
+
+
+class WriteHandle:
+    """File handle proxy making the file forget its cached size when the
+    handle is closed (or garbage-collected), as the size is only final then.
+    """
+
+    def __init__(self, fileobject, handle):
+        self._fileobject = fileobject
+        self._handle = handle
+
+    def close(self):
+        try:
+            self._handle.close()
+        finally:
+            self._fileobject._forget_size()
+
+    def __getattr__(self, attr):
+        return getattr(self._handle, attr)
+
+    def __iter__(self):
+        return iter(self._handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if hasattr(self._handle, "__exit__"):
+                return self._handle.__exit__(*exc_info)
+            self._handle.close()
+        finally:
+            self._fileobject._forget_size()
+
+    def __del__(self):
+        try:
+            self._fileobject._forget_size()
+        except Exception:  # e.g. at interpreter shutdown
+            pass
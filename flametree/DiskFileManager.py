@@ -1,5 +1,4 @@
 import os
-import shutil
 
 
 class DiskFileManager:
@@ -12,79 +11,362 @@ class DiskFileManager:
     replace
       If the ``target`` directory exists, should it be completely replaced
       or simply appended to ?
+
+    atomic
+      If True, files are written into temporary files in the same directory,
+      which replace the files when ``commit()`` is called (also called by
+      ``close()``). The temporary files are all synced to the disk, then
+      moved in place, then their directories are synced, so that a crash
+      never leaves a partially written file, and this is much faster than
+      syncing every file separately. Until then the tree reads the new
+      content from the temporary files.
     """
 
-    def __init__(self, target, replace=False):
+    hash_recorder = None
+
+    def __init__(self, target, replace=False, atomic=False):
         self.target = target
         if replace and os.path.exists(target):
+            import shutil
+
             shutil.rmtree(target)
         if not os.path.exists(target):
             os.makedirs(target)
+        self.entries_cache = {}
+        self.atomic = atomic
+        self.pending_files = {}  # {target path: temporary file path}
+        self.open_atomic_files = set()
+        self.replaced_paths = set()  # files to write without their content
+        if atomic:
+            # Permissions of new files, as open() would create them.
+            umask = os.umask(0)
+            os.umask(umask)
+            self.new_file_mode = 0o666 & ~umask
 
     @staticmethod
-    def list_directory_content(directory, element_type="file"):
+    def scan_directory(path):
+        """Return the ``{name: os.DirEntry}`` of a directory (listed with
+        ``os.scandir``)."""
+        try:
+            return {entry.name: entry for entry in os.scandir(path)}
+        except (FileNotFoundError, NotADirectoryError):  # e.g. deleted since
+            return {}
+
+    def directory_entries(self, path):
+        """Return the ``{name: os.DirEntry}`` of a directory, cached when
+        file sizes are first requested in this directory. The entries cache
+        their own ``stat`` results, so sizes are obtained with at most one
+        system call per file, and none for the following requests."""
+        entries = self.entries_cache.get(os.path.normpath(path), None)
+        if entries is None:
+            entries = self.scan_directory(path)
+            self.entries_cache[os.path.normpath(path)] = entries
+        return entries
+
+    def invalidate(self, target):
+        """Forget the cached metadata concerning the given file or dir."""
+        path = os.path.normpath(target._path)
+        self.entries_cache.pop(os.path.normpath(os.path.dirname(path)), None)
+        if target._is_dir:
+            self.entries_cache.pop(path, None)
+
+    def temporary_paths(self):
+        """Return the set of the temporary files of the atomic mode."""
+        paths = set(self.pending_files.values())
+        paths.update(f._temp_path for f in self.open_atomic_files)
+        return paths
+
+    def visible_entries(self, path):
+        """Return the ``os.DirEntry`` of a directory, without the temporary
+        files of the atomic mode."""
+        entries = self.scan_directory(path).values()
+        if not self.atomic:
+            return list(entries)
+        temporary_paths = self.temporary_paths()
+        return [
+            entry
+            for entry in entries
+            if os.path.join(path, entry.name) not in temporary_paths
+        ]
+
+    def pending_names(self, path):
+        """Return the names of the files of the directory which only exist as
+        temporary files until the next commit."""
+        return [
+            os.path.basename(target)
+            for target in self.pending_files
+            if (os.path.dirname(target) == path) and not os.path.exists(target)
+        ]
+
+    def list_directory_content(self, directory, element_type="file"):
         """Return the list of all file or dir objects in the directory."""
-        filtr = os.path.isfile if (element_type == "file") else os.path.isdir
-        path = directory._path
-        return (
-            []
-            if not os.path.exists(path)
-            else [name for name in os.listdir(path) if filtr(os.path.join(path, name))]
-        )
+        entries = self.visible_entries(directory._path)
+        if element_type == "file":
+            names = [entry.name for entry in entries if entry.is_file()]
+            return names + self.pending_names(directory._path)
+        else:
+            return [entry.name for entry in entries if entry.is_dir()]
 
-    @classmethod
-    def list_files(cls, directory):
+    def list_files(self, directory):
         """Return the list of all file objects in the directory."""
-        return cls.list_directory_content(directory, element_type="file")
+        return self.list_directory_content(directory, element_type="file")
 
-    @classmethod
-    def list_dirs(cls, directory):
+    def list_dirs(self, directory):
         """Return the list of all directory objects in the directory."""
-        return cls.list_directory_content(directory, element_type="dirs")
+        return self.list_directory_content(directory, element_type="dirs")
+
+    def list_entries(self, directory, with_stats=False):
+        """Return a list of ``(name, is_dir, size, mtime)`` for all files and
+        subdirectories of the directory, where the size and modification time
+        are None unless ``with_stats`` is True (directories have no size)."""
+        entries = []
+        for entry in self.visible_entries(directory._path):
+            is_dir = entry.is_dir()
+            size = mtime = None
+            if with_stats:
+                pending_path = self.pending_files.get(entry.path, None)
+                if pending_path is None:
+                    stat = entry.stat()
+                else:
+                    stat = os.stat(pending_path)
+                size = None if is_dir else stat.st_size
+                mtime = stat.st_mtime
+            entries.append((entry.name, is_dir, size, mtime))
+        for name in self.pending_names(directory._path):
+            size = mtime = None
+            if with_stats:
+                path = os.path.join(directory._path, name)
+                stat = os.stat(self.pending_files[path])
+                size, mtime = stat.st_size, stat.st_mtime
+            entries.append((name, False, size, mtime))
+        return entries
+
+    def file_size(self, fileobject, compressed=False):
+        """Return the size of the file in bytes, from cached metadata."""
+        path = fileobject._path
+        if path in self.pending_files:
+            return os.path.getsize(self.pending_files[path])
+        entry = self.directory_entries(os.path.dirname(path)).get(
+            os.path.basename(path), None
+        )
+        if entry is None:
+            return os.path.getsize(path)
+        return entry.stat().st_size
 
     @staticmethod
-    def read(fileobject, mode="r"):
+    def mtime(directory):
+        """Return the modification time of the directory (in ns), or None if
+        the directory doesn't exist."""
+        try:
+            return os.stat(directory._path).st_mtime_ns
+        except OSError:
+            return None
+
+    def current_path(self, path):
+        """Return the path where the current content of a file is, i.e. its
+        temporary file if it was written in atomic mode since the last
+        commit."""
+        return self.pending_files.get(path, path)
+
+    def exists(self, target):
+        """Return whether the file or directory exists on disk."""
+        return os.path.exists(self.current_path(target._path))
+
+    def read(self, fileobject, mode="r"):
         """Return the entire content of a file. The mode can be 'r' or 'rb'."""
-        with open(fileobject._path, mode=mode) as f:
+        with open(self.current_path(fileobject._path), mode=mode) as f:
             result = f.read()
         return result
 
-    @staticmethod
-    def write(fileobject, content, mode="a"):
+    def write(self, fileobject, content, mode="a"):
         """Write the content (str, bytes) to the given file object."""
-        with open(fileobject._path, mode=mode) as f:
-            f.write(content)
+        self.invalidate(fileobject)
+        if self.atomic:
+            with self.open_atomic(fileobject._path, mode=mode) as f:
+                f.write(content)
+        else:
+            with open(fileobject._path, mode=mode) as f:
+                f.write(content)
+
+    def open_atomic(self, path, mode="a"):
+        """Return a handle on a temporary copy of the file, which replaces
+        the file at the next commit after the handle is closed."""
+        import shutil
+        import tempfile
+
+        directory, name = os.path.split(path)
+        fd, temp_path = tempfile.mkstemp(
+            dir=directory or ".", prefix="." + name + ".", suffix=".tmp"
+        )
+        os.close(fd)
+        current_path = self.current_path(path)
+        if os.path.exists(current_path):
+            if mode.startswith("a") and (path not in self.replaced_paths):
+                shutil.copyfile(current_path, temp_path)
+            shutil.copymode(current_path, temp_path)
+        else:
+            os.chmod(temp_path, self.new_file_mode)
+        atomic_file = AtomicFile(self, open(temp_path, mode=mode), temp_path, path)
+        self.open_atomic_files.add(atomic_file)
+        return atomic_file
+
+    def commit(self):
+        """Replace the files written in atomic mode by their temporary files.
+
+        The temporary files are first all synced to the disk, then moved in
+        place, then their directories are synced, once each.
+        """
+        pending_files = list(self.pending_files.items())
+        for path, temp_path in pending_files:
+            fd = os.open(temp_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        directories = set()
+        for path, temp_path in pending_files:
+            os.replace(temp_path, path)
+            del self.pending_files[path]
+            directories.add(os.path.dirname(os.path.abspath(path)))
+        self.entries_cache.clear()
+        for directory in directories:
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+            except OSError:  # Directories can't be opened on Windows
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
 
     @staticmethod
-    def delete(target):
+    def stored_hash(fileobject, algo="md5"):
+        """Files on disk have no stored hash, this always returns None."""
+        return None
+
+    def delete(self, target):
         """Delete the file on disk."""
+        self.invalidate(target)
         if target._is_dir:
+            import shutil
+
+            prefix = os.path.join(target._path, "")
+            for path in list(self.pending_files):
+                if path.startswith(prefix):
+                    del self.pending_files[path]
             shutil.rmtree(target._path)
         else:
-            os.remove(target._path)
+            self.replaced_paths.discard(target._path)
+            temp_path = self.pending_files.pop(target._path, None)
+            if temp_path is not None:
+                os.remove(temp_path)
+            if os.path.exists(target._path):
+                os.remove(target._path)
 
     def create(self, target, replace=False):
-        """Create a new, empty file or directory on disk."""
+        """Create a new, empty file or directory on disk.
+
+        In atomic mode, existing files are not emptied: their content is
+        replaced by the next write, and kept if that write fails.
+        """
         path = target._path
+        if self.atomic and (not target._is_dir) and self.exists(target):
+            if replace:
+                self.replaced_paths.add(path)
+            return
         if replace and os.path.exists(path):
             self.delete(target)
         if replace or (not os.path.exists(path)):
+            self.invalidate(target)
             if target._is_dir:
                 os.mkdir(path)
             else:
                 with open(path, "w") as f:
                     pass
 
+    def handle_spec(self):
+        """Return the ``(manager_class, path)`` needed to reopen this file
+        tree in another process (see ``FileHandle``)."""
+        return (self.__class__, self.target)
+
+    @staticmethod
+    def source_path(path):
+        """Return the path of the folder (see ``FileHandle``)."""
+        return path
+
+    @classmethod
+    def reopen(cls, path):
+        """Return a manager reading an existing folder, without creating
+        anything (see ``FileHandle``)."""
+        if not os.path.isdir(path):
+            raise IOError("No such directory: %s" % path)
+        return cls(path)
+
     @staticmethod
     def join_paths(*paths):
         """Join paths in a system/independent way -- actually os.path.join."""
         return os.path.join(*paths)
 
-    @staticmethod
-    def close():
-        """This method does nothing for DiskFileManagers."""
-        pass
+    def close(self):
+        """Close the files still open in atomic mode, and replace the files
+        written in atomic mode (see ``commit``)."""
+        for atomic_file in list(self.open_atomic_files):
+            atomic_file.close()
+        self.commit()
+
+    def discard_open_files(self):
+        """Remove the temporary files of the files still open in atomic mode,
+        leaving their targets untouched (e.g. after an error). The files
+        already closed are still replaced at the next commit."""
+        for atomic_file in list(self.open_atomic_files):
+            atomic_file.discard()
 
     def open(self, fileobject, mode="a"):
         """Open a file on disk at the location given by the file object."""
-        return open(fileobject._path, mode=mode)
+        if mode not in ("r", "rb"):
+            self.invalidate(fileobject)
+            if self.atomic:
+                return self.open_atomic(fileobject._path, mode=mode)
+        return open(self.current_path(fileobject._path), mode=mode)
+
+
+class AtomicFile:
+    """File handle writing to a temporary file, which replaces the target
+    file at the next commit of the manager after the handle is closed."""
+
+    def __init__(self, manager, handle, temp_path, path):
+        self._manager = manager
+        self._handle = handle
+        self._temp_path = temp_path
+        self._path = path
+
+    def close(self):
+        if not self._handle.closed:
+            self._handle.close()
+            manager = self._manager
+            previous_temp_path = manager.pending_files.pop(self._path, None)
+            if previous_temp_path is not None:
+                os.remove(previous_temp_path)
+            manager.pending_files[self._path] = self._temp_path
+            manager.replaced_paths.discard(self._path)
+            manager.open_atomic_files.discard(self)
+
+    def __getattr__(self, attr):
+        return getattr(self._handle, attr)
+
+    def __enter__(self):
+        return self
+
+    def discard(self):
+        """Close the handle and remove the temporary file, leaving the target
+        file untouched."""
+        if not self._handle.closed:
+            self._handle.close()
+            os.remove(self._temp_path)
+            self._manager.open_atomic_files.discard(self)
+
+    def __exit__(self, exc_type, *a):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,115 @@
+import os
+
+from .Directory import Directory
+
+# File trees reopened in this process, as {spec: (source_stamp, root)}.
+_ROOTS = {}
+
+
+def source_stamp(spec):
+    """Return the modification time and size of the file or folder the tree
+    described by ``spec`` is read from, which change when the tree is
+    modified. Raise an IOError if it doesn't exist."""
+    manager_class, path = spec
+    source = manager_class.source_path(path)
+    try:
+        stat = os.stat(source)
+    except OSError:
+        raise IOError("No such file tree: %s" % source)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def reopened_root(spec):
+    """Return the (non-explored) root of the tree described by the file
+    manager specification ``(manager_class, path)``, opened read-only.
+
+    The tree is reopened only once per process, and again if it has been
+    modified since (e.g. files were added to the zip archive)."""
+    stamp = source_stamp(spec)
+    cached = _ROOTS.get(spec, None)
+    if (cached is not None) and (cached[0] == stamp):
+        return cached[1]
+    if cached is not None:
+        cached[1]._file_manager.close()
+    manager_class, path = spec
+    root = Directory(path, file_manager=manager_class.reopen(path), explore=False)
+    _ROOTS[spec] = (stamp, root)
+    return root
+
+
+def forget_roots():
+    """Forget the trees reopened in this process. This is the initializer
+    of worker processes, which could otherwise inherit (when forked) the
+    parent's reopened trees and their open files."""
+    _ROOTS.clear()
+
+
+def apply_to_file(func, handle):
+    """Return ``func(f)`` where ``f`` is the File the handle points to."""
+    return func(handle._resolve())
+
+
+class FileHandle:
+    """Lightweight, picklable reference to a file in a file tree.
+
+    A handle only holds the specification of the tree's file manager and the
+    path of the file in the tree, so it can be sent to other processes (e.g.
+    with ``multiprocessing`` or ``concurrent.futures``) at a very small cost.
+    In the other process, the tree is reopened the first time a handle is
+    used (read-only), then shared by all handles to the same tree, until the
+    tree is modified. The handles see the files as they are on the disk or in
+    the archive (files not yet flushed into a zip archive are not visible).
+
+    Handles are obtained with ``File._handle()`` or ``Directory._handles()``.
+
+    Parameters
+    ----------
+
+    spec
+      Tuple ``(manager_class, path)`` as returned by the file manager's
+      ``handle_spec()`` method.
+
+    path
+      Path of the file relative to the root of the tree, with '/' separators.
+    """
+
+    def __init__(self, spec, path):
+        self.spec = spec
+        self.path = path
+
+    @property
+    def _name(self):
+        return self.path.split("/")[-1]
+
+    @property
+    def _extension(self):
+        return "" if "." not in self._name else self._name.split(".")[-1]
+
+    def _resolve(self):
+        """Return the File object in the current process."""
+        return reopened_root(self.spec)._element_at(self.path)
+
+    def read(self, mode="r"):
+        """Return the file's content as a string (mode 'r') or bytes ('rb')."""
+        return self._resolve().read(mode=mode)
+
+    def open(self, mode="r"):
+        """Open the file (in read mode by default)."""
+        return self._resolve().open(mode=mode)
+
+    def __getstate__(self):
+        return (self.spec, self.path)
+
+    def __setstate__(self, state):
+        self.spec, self.path = state
+
+    def __eq__(self, other):
+        return isinstance(other, FileHandle) and (
+            (self.spec, self.path) == (other.spec, other.path)
+        )
+
+    def __hash__(self):
+        return hash((self.spec, self.path))
+
+    def __repr__(self):
+        return "<FileHandle %s>" % self.path
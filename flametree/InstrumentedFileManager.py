@@ -0,0 +1,166 @@
+import time
+from collections import defaultdict
+
+
+def _instrumented(operation, bytes_read=None, bytes_written=None):
+    """Return a method calling the wrapped manager's method of the same name
+    and recording its statistics."""
+
+    def method(self, *args, **kw):
+        func = getattr(self.file_manager, operation)
+        if not self.enabled:
+            return func(*args, **kw)
+        t0 = time.perf_counter()
+        result = None
+        try:
+            result = func(*args, **kw)
+        finally:
+            duration = time.perf_counter() - t0
+            self.record(
+                operation,
+                duration,
+                bytes_read=0 if bytes_read is None else bytes_read(args, result),
+                bytes_written=0 if bytes_written is None else bytes_written(args),
+            )
+        return result
+
+    method.__name__ = operation
+    method.__doc__ = "Instrumented version of the manager's ``%s``." % operation
+    return method
+
+
+def _length(data):
+    """Return the number of bytes of the data (str are counted as UTF-8)."""
+    if data is None:
+        return 0
+    if isinstance(data, str):
+        return len(data.encode("utf-8"))
+    return len(data)
+
+
+class InstrumentedFileManager:
+    """Wrapper around a file manager recording statistics on its operations.
+
+    The instrumented manager behaves like the wrapped manager, and counts the
+    calls, time spent, bytes read and written (including through file handles
+    obtained with ``open``) and directories listed. Get the current figures
+    with ``.stats()``.
+
+    Parameters
+    ----------
+
+    file_manager
+      Any Flametree file manager (DiskFileManager, ZipFileManager...).
+
+    hooks
+      List of functions ``hook(operation, duration, nbytes)`` called after
+      every operation, e.g. to forward the figures to a metrics exporter.
+
+    enabled
+      When False, the calls go straight to the wrapped manager and nothing is
+      recorded. This can be changed at any time by setting ``.enabled``.
+    """
+
+    def __init__(self, file_manager, hooks=(), enabled=True):
+        self.file_manager = file_manager
+        self.hooks = list(hooks)
+        self.enabled = enabled
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Set all counters back to zero."""
+        self.calls = defaultdict(int)
+        self.durations = defaultdict(float)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.directories_listed = 0
+
+    def add_hook(self, hook):
+        """Add a function ``hook(operation, duration, nbytes)`` to be called
+        after every operation."""
+        self.hooks.append(hook)
+
+    def record(self, operation, duration=0, bytes_read=0, bytes_written=0):
+        """Record an operation in the statistics and call the hooks."""
+        self.calls[operation] += 1
+        self.durations[operation] += duration
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+        if operation in ("list_files", "list_entries"):
+            self.directories_listed += 1
+        for hook in self.hooks:
+            hook(operation, duration, bytes_read + bytes_written)
+
+    def stats(self):
+        """Return a snapshot of the statistics as a dict."""
+        return {
+            "calls": dict(self.calls),
+            "time": dict(self.durations),
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "directories_listed": self.directories_listed,
+        }
+
+    list_files = _instrumented("list_files")
+    list_dirs = _instrumented("list_dirs")
+    read = _instrumented("read", bytes_read=lambda args, result: _length(result))
+    write = _instrumented("write", bytes_written=lambda args: _length(args[1]))
+    create = _instrumented("create")
+    delete = _instrumented("delete")
+    close = _instrumented("close")
+    mtime = _instrumented("mtime")
+    file_size = _instrumented("file_size")
+    stored_hash = _instrumented("stored_hash")
+    _list_entries = _instrumented("list_entries")
+
+    @property
+    def list_entries(self):
+        """Instrumented version of the manager's ``list_entries``, only
+        available if the manager has one (see ``Directory._list``)."""
+        self.file_manager.list_entries  # raise an AttributeError if missing
+        return self._list_entries
+
+    def open(self, fileobject, mode="a"):
+        """Instrumented version of the manager's ``open``."""
+        if not self.enabled:
+            return self.file_manager.open(fileobject, mode=mode)
+        t0 = time.perf_counter()
+        handle = self.file_manager.open(fileobject, mode=mode)
+        self.record("open", time.perf_counter() - t0)
+        return CountingHandle(self, handle)
+
+    def __getattr__(self, attr):
+        return getattr(self.file_manager, attr)
+
+
+class CountingHandle:
+    """File handle proxy counting the bytes read and written through it."""
+
+    def __init__(self, manager, handle):
+        self._manager = manager
+        self._handle = handle
+
+    def read(self, *args):
+        result = self._handle.read(*args)
+        self._manager.bytes_read += _length(result)
+        return result
+
+    def write(self, data):
+        self._manager.bytes_written += _length(data)
+        return self._handle.write(data)
+
+    def __iter__(self):
+        for line in self._handle:
+            self._manager.bytes_read += _length(line)
+            yield line
+
+    def __getattr__(self, attr):
+        return getattr(self._handle, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if hasattr(self._handle, "__exit__"):
+            return self._handle.__exit__(*exc_info)
+        self._handle.close()
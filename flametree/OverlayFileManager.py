@@ -0,0 +1,269 @@
+import copy
+import os
+import struct
+import zipfile
+
+from .DiskFileManager import DiskFileManager
+from .ZipFileManager import ZipFileManager, write_raw_member
+
+WHITEOUT_PREFIX = ".wh."
+
+
+class OverlayElement:
+    """Minimal file or directory object pointing to a path in one of the
+    layers of an overlay."""
+
+    def __init__(self, path, is_dir):
+        self._path = path
+        self._is_dir = is_dir
+        self._name = os.path.basename(path)
+
+
+def copy_zipped_file(reader, info, writer):
+    """Copy a file from a zip archive into another without decompressing
+    and recompressing it."""
+    fp = reader.fp
+    fp.seek(info.header_offset)
+    header = fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+    data = fp.read(info.compress_size)
+
+    new_info = copy.copy(info)
+    new_info.flag_bits &= ~0x08  # sizes in the local header, no descriptor.
+    new_info.extra = zipfile._strip_extra(info.extra, (1,))  # zip64 sizes
+    write_raw_member(writer, new_info, data)
+
+
+class OverlayFileManager:
+    """Copy-on-write file tree over a read-only zip archive.
+
+    Files are read from an upper, writable layer (a disk folder or a SQLite
+    database, possibly in memory) if they are there, or else from the base
+    zip archive, which is never modified. Writes go to the upper layer (after
+    copying the file from the archive if it is appended to), and deleting a
+    file or directory of the archive creates a "whiteout" marker file
+    ``.wh.<name>`` in the upper layer, hiding it.
+
+    The final tree can be written as a new zip archive with ``commit``, where
+    the unchanged files of the base archive are copied without being
+    decompressed.
+
+    Parameters
+    ----------
+
+    base
+      A ZipFileManager, used read-only.
+
+    upper
+      A DiskFileManager or SQLiteFileManager where the changes are written.
+    """
+
+    hash_recorder = None
+
+    def __init__(self, base, upper):
+        if not isinstance(base, ZipFileManager):
+            raise ValueError("The base of an overlay should be a zip archive.")
+        self.base = base
+        self.upper = upper
+        self.path = base.path
+        if isinstance(upper, DiskFileManager):
+            self.upper_root = upper.target
+        else:
+            self.upper_root = upper.path
+
+    def relative_path(self, target):
+        return target._path[len(self.path) + 1 :].replace(os.sep, "/")
+
+    def upper_element(self, path, is_dir=False):
+        if path == "":
+            return OverlayElement(self.upper_root, is_dir=True)
+        return OverlayElement(os.path.join(self.upper_root, *path.split("/")), is_dir)
+
+    def base_element(self, path, is_dir=False):
+        if path == "":
+            return OverlayElement(self.path, is_dir=True)
+        return OverlayElement(self.path + "/" + path, is_dir)
+
+    def in_upper(self, path, is_dir=False):
+        return self.upper.exists(self.upper_element(path, is_dir))
+
+    def is_whited_out(self, path):
+        parent, _, name = path.rpartition("/")
+        return (path != "") and self.in_upper(
+            (parent + "/" if parent else "") + WHITEOUT_PREFIX + name
+        )
+
+    def base_is_visible(self, path):
+        """Return whether the base archive's content at this path (and under
+        it) is visible, i.e. not hidden by a whiteout of it or its parents."""
+        parts = path.split("/")
+        for i in range(len(parts)):
+            if self.is_whited_out("/".join(parts[: i + 1])):
+                return False
+        return True
+
+    def in_base(self, path, is_dir=False):
+        if is_dir:
+            found = (path == "") or ((path + "/") in self.base.index)
+        else:
+            found = self.base.zipped_info(path) is not None
+        return found and self.base_is_visible(path)
+
+    def exists(self, target):
+        path = self.relative_path(target)
+        return self.in_upper(path, target._is_dir) or self.in_base(
+            path, target._is_dir
+        )
+
+    def list_directory_content(self, directory, is_dir=False):
+        path = self.relative_path(directory)
+        names = set()
+        if self.in_upper(path, is_dir=True):
+            element = self.upper_element(path, is_dir=True)
+            upper_list = self.upper.list_dirs if is_dir else self.upper.list_files
+            names.update(upper_list(element))
+        if self.in_base(path, is_dir=True):
+            base_list = self.base.list_dirs if is_dir else self.base.list_files
+            prefix = path + "/" if path else ""
+            for name in base_list(self.base_element(path, is_dir=True)):
+                if not self.is_whited_out(prefix + name):
+                    names.add(name)
+        return sorted(n for n in names if not n.startswith(WHITEOUT_PREFIX))
+
+    def list_files(self, directory):
+        return self.list_directory_content(directory, is_dir=False)
+
+    def list_dirs(self, directory):
+        return self.list_directory_content(directory, is_dir=True)
+
+    @staticmethod
+    def mtime(directory):
+        return None
+
+    def layer_element(self, target):
+        """Return the manager and element where the target can be read."""
+        path = self.relative_path(target)
+        if self.in_upper(path, target._is_dir):
+            return self.upper, self.upper_element(path, target._is_dir)
+        if self.in_base(path, target._is_dir):
+            return self.base, self.base_element(path, target._is_dir)
+        raise IOError("No such file: %s" % path)
+
+    def read(self, fileobject, mode="r"):
+        manager, element = self.layer_element(fileobject)
+        return manager.read(element, mode=mode)
+
+    def file_size(self, fileobject, compressed=False):
+        manager, element = self.layer_element(fileobject)
+        return manager.file_size(element, compressed)
+
+    def invalidate(self, fileobject):
+        """Forget the cached metadata of the file in the upper layer."""
+        invalidate = getattr(self.upper, "invalidate", None)
+        if invalidate is not None:
+            invalidate(self.upper_element(self.relative_path(fileobject)))
+
+    def stored_hash(self, fileobject, algo="md5"):
+        manager, element = self.layer_element(fileobject)
+        return manager.stored_hash(element, algo=algo)
+
+    def create_upper_dirs(self, path):
+        """Create the parent directories of the path in the upper layer."""
+        parts = path.split("/")
+        for i in range(1, len(parts)):
+            element = self.upper_element("/".join(parts[:i]), is_dir=True)
+            self.upper.create(element, replace=False)
+
+    def copy_up(self, fileobject, mode):
+        """Prepare the upper layer to write the file with the given mode,
+        and return the file's element in the upper layer."""
+        path = self.relative_path(fileobject)
+        self.create_upper_dirs(path)
+        element = self.upper_element(path)
+        if not self.in_upper(path):
+            content = b""
+            if mode.startswith("a") and self.in_base(path):
+                content = self.base.read(self.base_element(path), mode="rb")
+            self.upper.write(element, content, mode="wb")
+        return element
+
+    def write(self, fileobject, content, mode="a"):
+        element = self.copy_up(fileobject, mode)
+        self.upper.write(element, content, mode=mode)
+
+    def open(self, fileobject, mode="a"):
+        if mode in ("r", "rb"):
+            manager, element = self.layer_element(fileobject)
+            return manager.open(element, mode=mode)
+        return self.upper.open(self.copy_up(fileobject, mode), mode=mode)
+
+    def delete(self, target):
+        path = self.relative_path(target)
+        if self.in_upper(path, target._is_dir):
+            self.upper.delete(self.upper_element(path, target._is_dir))
+        if self.in_base(path, target._is_dir):
+            self.create_upper_dirs(path)
+            parent, _, name = path.rpartition("/")
+            whiteout = (parent + "/" if parent else "") + WHITEOUT_PREFIX + name
+            self.upper.create(self.upper_element(whiteout), replace=True)
+
+    def create(self, target, replace=False):
+        exists = self.exists(target)
+        if replace and exists:
+            self.delete(target)
+        if replace or not exists:
+            path = self.relative_path(target)
+            self.create_upper_dirs(path)
+            self.upper.create(self.upper_element(path, target._is_dir), replace=True)
+
+    def handle_spec(self):
+        raise ValueError("Overlay trees can't be reopened in other processes.")
+
+    @staticmethod
+    def join_paths(*paths):
+        return "/".join(*paths)
+
+    def iter_file_paths(self, path=""):
+        """Iterate over the relative paths of all files in the overlay."""
+        directory = self.base_element(path, is_dir=True)
+        prefix = path + "/" if path else ""
+        for name in self.list_files(directory):
+            yield prefix + name
+        for name in self.list_dirs(directory):
+            for file_path in self.iter_file_paths(prefix + name):
+                yield file_path
+
+    def commit(self, target=None):
+        """Write the overlay's files into a new zip archive.
+
+        The files of the base archive which were not modified are copied
+        without being decompressed. ``target`` is a path or a writable file
+        object. By default, the base archive is replaced by the new archive
+        (only possible for archives on the disk).
+        """
+        if target is None:
+            if self.base.source != self.base.path:
+                raise ValueError(
+                    "The base archive is not on the disk, a target is needed."
+                )
+            temp_path = self.base.path + ".tmp"
+            self.commit(target=temp_path)
+            self.base.reader.close()
+            os.replace(temp_path, self.base.path)
+            self.base.reader = zipfile.ZipFile(self.base.path, "r")
+            self.base._index = None
+            return
+        with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as writer:
+            for path in self.iter_file_paths():
+                if self.in_upper(path):
+                    element = self.upper_element(path)
+                    writer.writestr(path, self.upper.read(element, mode="rb"))
+                else:
+                    copy_zipped_file(
+                        self.base.reader, self.base.zipped_info(path), writer
+                    )
+
+    def close(self):
+        self.upper.close()
+        self.base.close()
@@ -0,0 +1,253 @@
+import os
+import sqlite3
+import threading
+from io import StringIO, BytesIO
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    content BLOB
+);
+CREATE INDEX IF NOT EXISTS entries_by_parent ON entries (parent, is_dir, name);
+"""
+
+
+class SQLiteFileManager:
+    """Reader and Writer of file trees stored in a SQLite database.
+
+    All files and directories are stored in a single table indexed by path
+    and by parent directory, so that finding or listing files takes a time
+    logarithmic in the number of files. This is well adapted to trees with
+    millions of small files, which would exhaust inodes on the disk and
+    stay in memory until the end in zip archives.
+
+    Writes are grouped in transactions of ``batch_size`` operations, and the
+    last transaction is committed with ``commit()`` or ``close()``.
+
+    Parameters
+    ----------
+
+    path
+      Path to the database file, or ":memory:" for an in-memory database.
+
+    replace
+      If the database file already exists, should it be erased or appended
+      to ?
+
+    batch_size
+      Number of writes (file creation, writes, deletions) grouped in a same
+      transaction.
+
+    read_only
+      If True, the existing database is opened in read-only mode.
+    """
+
+    hash_recorder = None
+
+    def __init__(self, path, replace=False, batch_size=1000, read_only=False):
+        self.path = path
+        if read_only:
+            from urllib.request import pathname2url
+
+            self.connection = sqlite3.connect(
+                "file:%s?mode=ro" % pathname2url(os.path.abspath(path)),
+                uri=True,
+                check_same_thread=False,
+            )
+        else:
+            if replace and (path != ":memory:") and os.path.exists(path):
+                os.remove(path)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.executescript(SCHEMA)
+        self.batch_size = batch_size
+        self.uncommitted = 0
+        self.lock = threading.RLock()  # for uses in parallel threads
+        self.closed = False
+        self.open_writers = set()
+
+    def relative_path(self, target):
+        return target._path[len(self.path) + 1 :].replace(os.sep, "/")
+
+    def execute(self, query, *parameters):
+        with self.lock:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def modify(self, query, *parameters):
+        """Execute a modifying query, committing the transaction every
+        ``batch_size`` modifications."""
+        with self.lock:
+            self.connection.execute(query, parameters)
+            self.uncommitted += 1
+            if self.uncommitted >= self.batch_size:
+                self.commit()
+
+    def commit(self):
+        """Commit the writes of the current transaction to the database."""
+        with self.lock:
+            self.connection.commit()
+            self.uncommitted = 0
+
+    def list_directory_content(self, directory, is_dir=0):
+        rows = self.execute(
+            "SELECT name FROM entries WHERE parent=? AND is_dir=? ORDER BY name",
+            self.relative_path(directory),
+            is_dir,
+        )
+        return [name for (name,) in rows]
+
+    def list_files(self, directory):
+        return self.list_directory_content(directory, is_dir=0)
+
+    def list_dirs(self, directory):
+        return self.list_directory_content(directory, is_dir=1)
+
+    def mtime(self, directory):
+        """Return the data version of the database, which changes when
+        other programs modify the database."""
+        return self.execute("PRAGMA data_version")[0][0]
+
+    def exists(self, target):
+        path = self.relative_path(target)
+        if path == "":  # The root directory has no entry in the table
+            return True
+        return len(self.execute("SELECT 1 FROM entries WHERE path=?", path)) > 0
+
+    def read(self, fileobject, mode="r"):
+        path = self.relative_path(fileobject)
+        rows = self.execute("SELECT content FROM entries WHERE path=?", path)
+        if rows == []:
+            raise IOError("No such file in the database: %s" % path)
+        result = bytes(rows[0][0] or b"")
+        if mode == "r":
+            result = result.decode("utf8")
+        return result
+
+    def write(self, fileobject, content, mode="a"):
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        if mode.startswith("a") and self.exists(fileobject):
+            content = self.read(fileobject, mode="rb") + content
+        path = self.relative_path(fileobject)
+        parent, _, name = path.rpartition("/")
+        self.modify(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, 0, ?)",
+            path,
+            parent,
+            name,
+            content,
+        )
+
+    def file_size(self, fileobject, compressed=False):
+        path = self.relative_path(fileobject)
+        query = "SELECT length(content) FROM entries WHERE path=?"
+        return self.execute(query, path)[0][0]
+
+    @staticmethod
+    def stored_hash(fileobject, algo="md5"):
+        """No hash is stored in the database, this always returns None."""
+        return None
+
+    def delete(self, target):
+        path = self.relative_path(target)
+        self.modify("DELETE FROM entries WHERE path=?", path)
+        if target._is_dir:
+            # All paths starting with "path/" ('0' is the character after '/')
+            self.modify(
+                "DELETE FROM entries WHERE path > ? AND path < ?",
+                path + "/",
+                path + "0",
+            )
+
+    def create(self, target, replace=False):
+        if replace and self.exists(target):
+            self.delete(target)
+        if replace or not self.exists(target):
+            path = self.relative_path(target)
+            parent, _, name = path.rpartition("/")
+            self.modify(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+                path,
+                parent,
+                name,
+                int(target._is_dir),
+                None if target._is_dir else b"",
+            )
+
+    def handle_spec(self):
+        """Return the ``(manager_class, path)`` needed to reopen this file
+        tree in another process (see ``FileHandle``)."""
+        if self.path == ":memory:":
+            raise ValueError("In-memory databases can't be reopened.")
+        return (self.__class__, self.path)
+
+    @staticmethod
+    def source_path(path):
+        """Return the path of the database (see ``FileHandle``)."""
+        return path
+
+    @classmethod
+    def reopen(cls, path):
+        """Return a manager reading an existing database, in read-only mode
+        (see ``FileHandle``)."""
+        if not os.path.isfile(path):
+            raise IOError("No such database: %s" % path)
+        return cls(path, read_only=True)
+
+    @staticmethod
+    def join_paths(*paths):
+        return "/".join(*paths)
+
+    def close(self):
+        for writer in list(self.open_writers):
+            writer.close()
+        self.commit()
+        self.connection.close()
+        self.closed = True
+
+    def open(self, fileobject, mode="a"):
+        if mode in ("r", "rb"):
+            container = {"r": StringIO, "rb": BytesIO}[mode]
+            return container(self.read(fileobject, mode=mode))
+        content = b""
+        if mode.startswith("a") and self.exists(fileobject):
+            content = self.read(fileobject, mode="rb")
+        container = SQLiteFileWriter if mode.endswith("b") else SQLiteTextFileWriter
+        writer = container(self, fileobject, content)
+        self.open_writers.add(writer)
+        return writer
+
+
+class SQLiteFileWriter(BytesIO):
+    """In-memory file handle whose content is written to the database when
+    the handle (or the manager) is closed."""
+
+    def __init__(self, manager, fileobject, content=b""):
+        BytesIO.__init__(self)
+        self.write(content)
+        self.manager = manager
+        self.fileobject = fileobject
+
+    def close(self):
+        if not (self.closed or self.manager.closed):
+            self.manager.write(self.fileobject, self.getvalue(), mode="wb")
+            self.manager.open_writers.discard(self)
+        BytesIO.close(self)
+
+
+class SQLiteTextFileWriter(StringIO):
+    """Text-mode version of SQLiteFileWriter."""
+
+    def __init__(self, manager, fileobject, content=b""):
+        StringIO.__init__(self)
+        self.write(content.decode("utf-8"))
+        self.manager = manager
+        self.fileobject = fileobject
+
+    def close(self):
+        if not (self.closed or self.manager.closed):
+            self.manager.write(self.fileobject, self.getvalue(), mode="w")
+            self.manager.open_writers.discard(self)
+        StringIO.close(self)
@@ -0,0 +1,394 @@
+import json
+import os
+import re
+import threading
+import weakref
+import zipfile
+from collections import defaultdict
+from concurrent import futures
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+
+from .ZipFileManager import (
+    ZipMemberWriter,
+    ZipMemberTextWriter,
+    deflated_member,
+    directories_index,
+    is_current_writer,
+    write_raw_member,
+    writer_data,
+)
+
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1e3, "MB": 1e6, "GB": 1e9, "TB": 1e12}
+
+
+def parse_size(size):
+    """Return the number of bytes in a size like 2000, "500kB" or "2GB"."""
+    if isinstance(size, str):
+        match = re.match(r"^\s*([\d.]+)\s*([a-zA-Z]*)\s*$", size)
+        if (match is None) or (match.groups()[1].upper() not in SIZE_UNITS):
+            raise ValueError("Unrecognized size: %s" % size)
+        number, unit = match.groups()
+        return int(float(number) * SIZE_UNITS[unit.upper()])
+    return int(size)
+
+
+class ShardWriter:
+    """Zip writer of a new shard. Members are compressed in parallel worker
+    threads, and only the writing of their compressed data into the shard is
+    done one member at a time."""
+
+    def __init__(self, path, index):
+        self.index = index
+        self.total = 0
+        self.writer = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        self.lock = threading.Lock()
+        self.futures = []
+        self.closed = False
+
+    def write(self, path, data, writing):
+        info, compressed = deflated_member(path, data)
+        with self.lock:
+            write_raw_member(self.writer, info, compressed)
+            writing.pop(path, None)
+
+    def close(self):
+        """Close the shard once all its members have been written."""
+        futures.wait(self.futures)
+        with self.lock:
+            if not self.closed:
+                self.writer.close()
+                self.closed = True
+
+
+class ShardedZipFileManager:
+    """Reader and Writer of file trees spread over several zip archives.
+
+    The files are written into "shard" archives whose paths are obtained by
+    replacing ``{shard}`` in the path template with a number, and a JSON index
+    file (the template with ``{shard}`` replaced by "index", and a ".json"
+    extension) records the shard and size of every file. The reader presents
+    all shards as a single tree, and only opens the shards where files are
+    read.
+
+    Like in ZipFileManager, files are kept in memory only until their handle
+    is closed (or until the manager is closed for files written with
+    ``write``), at which point they are compressed in a pool of worker
+    threads, in parallel even for files of the same shard, and appended to
+    their shard. A new shard is started when the current one reaches
+    ``shard_size``, and the previous shards are closed in the background
+    once their last files are written. No more than a few files per worker
+    are waiting to be written, so the memory used stays bounded.
+
+    Parameters
+    ----------
+
+    path
+      Path template such as "out-{shard}.zip".
+
+    shard_size
+      Maximal total size (uncompressed) of the files in a new shard, as a
+      number of bytes or a string like "2GB". Files bigger than this size
+      have a shard of their own.
+
+    shard_by
+      If "top", files are grouped in shards by top-level directory (and
+      further split by ``shard_size`` if provided).
+
+    replace
+      If shards and an index already exist for this template, should they be
+      erased or appended to ?
+
+    workers
+      Number of threads writing the shards. No more than twice this number of
+      files are kept in memory waiting to be written.
+    """
+
+    hash_recorder = None
+
+    def __init__(
+        self, path, shard_size=None, shard_by=None, replace=False, workers=4
+    ):
+        if "{shard}" not in path:
+            raise ValueError("The path should contain '{shard}'.")
+        self.path = path
+        self.shard_size = None if shard_size is None else parse_size(shard_size)
+        self.shard_by = shard_by
+        self.workers = workers
+        self.index_path = self.source_path(path)
+        self.shards, self.files = [], {}
+        if os.path.exists(self.index_path):
+            if replace:
+                with open(self.index_path, "r") as f:
+                    for shard in json.load(f)["shards"]:
+                        if os.path.exists(self.shard_path(shard)):
+                            os.remove(self.shard_path(shard))
+                os.remove(self.index_path)
+            else:
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+                self.shards, self.files = index["shards"], index["files"]
+        self.readers = {}
+        self.files_data = defaultdict(lambda *a: BytesIO())
+        self.open_writers = weakref.WeakValueDictionary()
+        self._index = None
+        self.writing = {}  # {path: data} of files being written in a shard
+        self.shard_writers = {}  # {shard: ShardWriter} of the new shards
+        self.current_shards = {}  # {group: ShardWriter} receiving new files
+        self.futures = set()
+        self._executor = None
+
+    def relative_path(self, target):
+        path = target._path[len(self.path) + 1 :]
+        if target._is_dir and path != "":
+            path += "/"
+        return path
+
+    @property
+    def index(self):
+        """Dict ``{directory_path: (file_names, dir_names)}`` of the files
+        already in the shards."""
+        if self._index is None:
+            self._index = directories_index(self.files.keys())
+        return self._index
+
+    def list_files(self, directory):
+        files, _ = self.index.get(self.relative_path(directory), ((), ()))
+        return sorted(files)
+
+    def list_dirs(self, directory):
+        _, dirs = self.index.get(self.relative_path(directory), ((), ()))
+        return sorted(dirs)
+
+    @staticmethod
+    def mtime(directory):
+        return None
+
+    def shard_path(self, shard_name):
+        """Return the path of a shard (shards are recorded in the index by
+        file name, relative to the index file)."""
+        return os.path.join(os.path.dirname(self.index_path), shard_name)
+
+    def reader(self, path):
+        """Return the zip reader of the shard containing the file."""
+        shard = self.files[path][0]
+        if shard not in self.readers:
+            shard_path = self.shard_path(self.shards[shard])
+            self.readers[shard] = zipfile.ZipFile(shard_path, "r")
+        return self.readers[shard]
+
+    @contextmanager
+    def archive(self, path):
+        """Yield the zip archive (reader, or writer of a new shard) where an
+        already-zipped file can be read."""
+        shard_writer = self.shard_writers.get(self.files[path][0], None)
+        if shard_writer is not None:
+            with shard_writer.lock:
+                if not shard_writer.closed:
+                    yield shard_writer.writer
+                    return
+        yield self.reader(path)
+
+    def is_pending(self, path):
+        """Return whether the file is in memory, not yet written in a shard."""
+        return (path in self.files_data) or (path in self.open_writers)
+
+    def pending_file(self, path):
+        """Return the in-memory file (or open handle) of a file not yet
+        written into a shard."""
+        writer = self.open_writers.get(path, None)
+        return self.files_data[path] if writer is None else writer
+
+    def pending_data(self, path):
+        """Return the bytes of a file not yet written into a shard."""
+        result = self.pending_file(path).getvalue()
+        if not isinstance(result, bytes):
+            result = result.encode("utf-8")
+        return result
+
+    def read(self, fileobject, mode="r"):
+        path = self.relative_path(fileobject)
+        if self.is_pending(path):
+            result = self.pending_data(path)
+        else:
+            result = self.writing.get(path, None)
+            if result is None:
+                with self.archive(path) as archive:
+                    result = archive.read(path)
+        if mode == "r":
+            result = result.decode("utf8")
+        return result
+
+    def path_exists_in_file(self, target):
+        return self.relative_path(target) in self.files
+
+    def write(self, fileobject, content, mode="w"):
+        path = self.relative_path(fileobject)
+        if self.path_exists_in_file(fileobject):
+            raise NotImplementedError(
+                "Rewriting a file already zipped is not currently supported."
+            )
+        if mode in ("w", "wb"):  # i.e. not append
+            self.files_data.pop(path, None)
+            self.open_writers.pop(path, None)
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        data = self.pending_file(path)
+        if not isinstance(data, BytesIO):  # file currently opened in text mode
+            content = content.decode("utf-8")
+        data.write(content)
+
+    @property
+    def executor(self):
+        """Pool of threads writing the new shards, started when needed."""
+        if self._executor is None:
+            self._executor = futures.ThreadPoolExecutor(self.workers)
+        return self._executor
+
+    def shard_writer(self, path, size):
+        """Return the writer of the shard where a new file goes, starting a
+        new shard if the current one would exceed ``shard_size``."""
+        group = path.split("/")[0] if (self.shard_by == "top") else None
+        shard_writer = self.current_shards.get(group, None)
+        if (shard_writer is not None) and (self.shard_size is not None):
+            if shard_writer.total + size > self.shard_size:
+                self.futures.add(self.executor.submit(shard_writer.close))
+                shard_writer = None
+        if shard_writer is None:
+            index = len(self.shards)
+            shard_path = self.path.format(shard=index)
+            self.shards.append(os.path.basename(shard_path))
+            shard_writer = ShardWriter(shard_path, index)
+            self.shard_writers[index] = shard_writer
+            self.current_shards[group] = shard_writer
+        shard_writer.total += size
+        return shard_writer
+
+    def wait(self, max_pending=0):
+        """Wait until no more than ``max_pending`` writes are pending."""
+        while len(self.futures) > max_pending:
+            done, self.futures = futures.wait(
+                self.futures, return_when=futures.FIRST_COMPLETED
+            )
+            for future in done:
+                future.result()  # raise the errors of the threads, if any
+
+    def flush(self, path):
+        """Write a file from memory into a new shard (in a worker thread)."""
+        if not self.is_pending(path):
+            return
+        self.write_to_shard(path, self.pending_data(path))
+
+    def flush_writer(self, writer):
+        """Flush the content of a handle being closed or garbage-collected,
+        unless the file was rewritten since the handle was opened."""
+        if (writer.path not in self.files) and is_current_writer(self, writer):
+            self.write_to_shard(writer.path, writer_data(writer))
+
+    def write_to_shard(self, path, data):
+        """Write a file's data into a new shard (in a worker thread) and free
+        the memory."""
+        self.files_data.pop(path, None)
+        self.open_writers.pop(path, None)
+        shard_writer = self.shard_writer(path, len(data))
+        self.files[path] = [shard_writer.index, len(data)]
+        self._index = None
+        self.writing[path] = data
+        future = self.executor.submit(shard_writer.write, path, data, self.writing)
+        shard_writer.futures.append(future)
+        self.futures.add(future)
+        self.wait(max_pending=2 * self.workers)
+
+    def file_size(self, fileobject, compressed=False):
+        path = self.relative_path(fileobject)
+        if self.is_pending(path):
+            return len(self.pending_data(path))
+        if path not in self.files:  # file created but never written
+            return 0
+        if compressed and (path not in self.writing):
+            with self.archive(path) as archive:
+                return archive.getinfo(path).compress_size
+        return self.files[path][1]
+
+    def stored_hash(self, fileobject, algo="md5"):
+        """Return the CRC32 stored in the shard for an already-zipped file
+        (if ``algo`` is "crc32"). Return None in any other case."""
+        path = self.relative_path(fileobject)
+        if (algo != "crc32") or (path not in self.files) or (path in self.writing):
+            return None
+        with self.archive(path) as archive:
+            return "%08x" % archive.getinfo(path).CRC
+
+    def delete(self, target):
+        raise NotImplementedError(
+            "Deleting/modifying/overwriting an already-zipped file "
+            "is not currently supported."
+        )
+
+    def create(self, target, replace=False):
+        if self.path_exists_in_file(target) and replace:
+            self.delete(target)
+
+    def handle_spec(self):
+        """Return the ``(manager_class, path)`` needed to reopen this file
+        tree in another process (see ``FileHandle``)."""
+        return (self.__class__, self.path)
+
+    @staticmethod
+    def source_path(path):
+        """Return the path of the index of the shards (see ``FileHandle``)."""
+        return os.path.splitext(path.format(shard="index"))[0] + ".json"
+
+    @classmethod
+    def reopen(cls, path):
+        """Return a manager reading existing shards, without creating
+        anything (see ``FileHandle``)."""
+        if not os.path.isfile(cls.source_path(path)):
+            raise IOError("No shards index for: %s" % path)
+        return cls(path)
+
+    @staticmethod
+    def join_paths(*paths):
+        return "/".join(*paths)
+
+    def open(self, fileobject, mode="a"):
+        path = self.relative_path(fileobject)
+        if mode in ("r", "rb"):
+            if (mode == "rb") and not self.is_pending(path):
+                if self.files[path][0] not in self.shard_writers:
+                    # Decompress on the fly rather than all at once
+                    return self.reader(path).open(path)
+            container = {"r": StringIO, "rb": BytesIO}[mode]
+            return container(self.read(fileobject, mode=mode))
+        if self.path_exists_in_file(fileobject):
+            raise NotImplementedError(
+                "Rewriting a file already zipped is not currently supported."
+            )
+        content = b""
+        if mode.startswith("a") and self.is_pending(path):
+            content = self.pending_data(path)
+        container = ZipMemberWriter if mode.endswith("b") else ZipMemberTextWriter
+        self.files_data.pop(path, None)
+        writer = container(self, path, content)
+        self.open_writers[path] = writer
+        return writer
+
+    def close(self):
+        """Write the remaining files into the shards, wait until all shards
+        are written, and update the index."""
+        for path in list(self.files_data) + list(self.open_writers.keys()):
+            self.flush(path)
+        for shard_writer in self.current_shards.values():
+            self.futures.add(self.executor.submit(shard_writer.close))
+        self.current_shards = {}
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+        if self.shard_writers:
+            with open(self.index_path, "w") as f:
+                json.dump({"shards": self.shards, "files": self.files}, f)
+            self.shard_writers = {}
@@ -0,0 +1,96 @@
+import threading
+import time
+import traceback
+
+
+class TreeWatcher:
+    """Keep a Directory up to date by refreshing it periodically in a
+    background thread.
+
+    Parameters
+    ----------
+
+    directory
+      The flametree Directory to keep up to date.
+
+    interval
+      Minimal time in seconds between two refreshes.
+
+    callback
+      Function ``callback(added, removed)`` called after each refresh which
+      found changes (see ``Directory._refresh``).
+
+    max_cpu_fraction
+      The time between two refreshes is increased if needed so that the
+      refreshes don't take more than this fraction of the time. This keeps the
+      cost of watching very large trees bounded.
+
+    error_callback
+      Function ``error_callback(error)`` called with the exceptions raised
+      during a refresh (or by ``callback``), after which the watcher keeps
+      running. By default the traceback is printed.
+
+    The tree is modified in the background thread while holding the tree's
+    ``_lock``, which should also be held to iterate over the tree's records
+    (``_files``, ``_dirs``...) from other threads.
+    """
+
+    def __init__(
+        self,
+        directory,
+        interval=1.0,
+        callback=None,
+        max_cpu_fraction=0.1,
+        error_callback=None,
+    ):
+        self.directory = directory
+        self.interval = interval
+        self.callback = callback
+        self.max_cpu_fraction = max_cpu_fraction
+        self.error_callback = error_callback
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Refresh the tree once, call the callback if anything changed, and
+        return the time it took."""
+        t0 = time.perf_counter()
+        added, removed = self.directory._refresh(recursive=True)
+        duration = time.perf_counter() - t0
+        if (added or removed) and (self.callback is not None):
+            self.callback(added, removed)
+        return duration
+
+    def _run(self):
+        delay = self.interval
+        while not self._stop_event.wait(delay):
+            try:
+                duration = self.refresh()
+            except Exception as error:
+                duration = 0
+                if self.error_callback is None:
+                    traceback.print_exc()
+                else:
+                    self.error_callback(error)
+            delay = max(self.interval, duration / self.max_cpu_fraction)
+
+    def start(self):
+        """Start watching the tree in a background (daemon) thread."""
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop watching the tree and wait for the thread to finish."""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *a):
+        self.stop()
@@ -1,8 +1,11 @@
 import os
 import sys
+import threading
+import time
+import weakref
 import zipfile
-import re
-from collections import defaultdict
+import zlib
+from collections import defaultdict, OrderedDict
 
 PYTHON3 = sys.version_info[0] == 3
 
@@ -20,6 +23,54 @@ else:
 EMPTY_ZIP_BYTES = b"PK\x05\x06" + 18 * b"\x00"
 
 
+def directories_index(names):
+    """Return a dict ``{directory_path: (file_names, dir_names)}`` listing
+    the content of all directories, from the full paths of zipped files
+    (where the directories paths end with '/', and the root path is '')."""
+    index = defaultdict(lambda: (set(), set()))
+    for name in names:
+        parts = name.split("/")
+        for i, part in enumerate(parts[:-1]):
+            if part != "":
+                index["".join(p + "/" for p in parts[:i])][1].add(part)
+        if parts[-1] != "":
+            index["".join(p + "/" for p in parts[:-1])][0].add(parts[-1])
+    return dict(index)
+
+
+def deflated_member(path, data):
+    """Return the ZipInfo and compressed data of a new zip member, so that
+    the data can be compressed outside of the archive writer's lock (see
+    ``write_raw_member``)."""
+    info = zipfile.ZipInfo(path, date_time=time.localtime(time.time())[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o600 << 16  # same permissions as writestr
+    info.file_size = len(data)
+    info.CRC = zlib.crc32(data) & 0xFFFFFFFF
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    info.compress_size = len(compressed)
+    return info, compressed
+
+
+def write_raw_member(writer, info, data):
+    """Write an already-compressed member into a zip archive being written.
+
+    This uses the internals of Python's ``zipfile`` writers (``fp``,
+    ``start_dir``, ``filelist``), as the module offers no public way to write
+    already-compressed data.
+    """
+    info.header_offset = writer.start_dir
+    if writer._seekable:
+        writer.fp.seek(writer.start_dir)
+    writer.fp.write(info.FileHeader())
+    writer.fp.write(data)
+    writer.filelist.append(info)
+    writer.NameToInfo[info.filename] = info
+    writer.start_dir = writer.fp.tell()
+    writer._didModify = True
+
+
 class ZipFileManager:
     """Reader and Writer of Zip files.
 
@@ -30,45 +81,77 @@ class ZipFileManager:
       Path to a zip archive to be read or written to.
 
     source
-      Either a string/byte representing zipped data, or a file-like object
-      connected to zipped data.
+      Either a string/bytes/bytearray/memoryview representing zipped data, or
+      a file-like object connected to zipped data. Bytes-like data is not
+      copied unless files are added to the archive.
 
     replace
       In case the provided ``path`` is pointing to an already-existing file,
       should it be erased or appended to ?
+
+    cache_size
+      Maximal total size (in bytes) of the zipped files' contents kept in
+      memory after being read, so that reading the same files again doesn't
+      decompress them again. The least recently read files are evicted first.
+      Default 0 means no cache.
     """
 
     # The Zipfile manager manages at the same time files already in the zip
     # archive when it was created, and files left uncompressed in memory.
     # The uncompressed files in memory are flushed into the archive upon
-    # closing of the manager, with the ``.close`` method.
+    # closing of the manager, with the ``.close`` method, except for files
+    # opened with ``.open`` which are flushed as soon as their handle is
+    # closed (or garbage-collected, as the manager only keeps weak references
+    # to the open handles).
+
+    hash_recorder = None
 
-    def __init__(self, path=None, source=None, replace=False):
+    def __init__(self, path=None, source=None, replace=False, cache_size=0):
         self.path = "." if path is None else path
         if path == "@memory":  # VIRTUAL ZIP FROM SCRATCH
             self.source = StringBytesIO()
-            self.writer = zipfile.ZipFile(
-                self.source, "a", compression=zipfile.ZIP_DEFLATED
-            )
             self.reader = zipfile.ZipFile(StringBytesIO(EMPTY_ZIP_BYTES), "r")
         elif path is not None:  # ON DISK ZIP
             self.source = path
             if replace or not os.path.exists(path):
                 with open(self.source, "wb") as f:
                     f.write(EMPTY_ZIP_BYTES)
-            self.writer = zipfile.ZipFile(
-                self.source, "a", compression=zipfile.ZIP_DEFLATED
-            )
             self.reader = zipfile.ZipFile(self.source, "r")
         else:  # VIRTUAL ZIP FROM EXISTING DATA
-            self.source = source
-            if isinstance(self.source, (str, bytes)):
+            if PYTHON3 and isinstance(source, str):
+                source = source.encode("latin-1")
+            if isinstance(source, bytes):
+                # In Python 3 the BytesIO shares the bytes data, no copy.
                 self.source = StringBytesIO(source)
-            self.writer = zipfile.ZipFile(
-                self.source, "a", compression=zipfile.ZIP_DEFLATED
-            )
+            elif isinstance(source, (bytearray, memoryview)):
+                self.source = BytesView(source)
+            else:
+                self.source = source
             self.reader = zipfile.ZipFile(self.source, "r")
+        self._writer = None
         self.files_data = defaultdict(lambda *a: StringBytesIO())
+        self.open_writers = weakref.WeakValueDictionary()
+        self.flushed = set()
+        self.closed = False
+        self._index = None
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()  # for reads in parallel threads
+        self.cache_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def writer(self):
+        """Zip writer appending to the archive, opened the first time
+        something is written in the archive."""
+        if self._writer is None:
+            if isinstance(self.source, BytesView):
+                self.source = StringBytesIO(self.source.getbuffer())
+            self._writer = zipfile.ZipFile(
+                self.source, "a", compression=zipfile.ZIP_DEFLATED
+            )
+        return self._writer
 
     def relative_path(self, target):
         path = target._path[len(self.path) + 1 :]
@@ -76,37 +159,133 @@ class ZipFileManager:
             path += "/"
         return path
 
-    def list_directory_components(self, directory, regexpr):
-        path = self.relative_path(directory)
-        matches = [
-            re.match(regexpr % re.escape(path), name) for name in self.reader.namelist()
-        ]
-        return sorted(
-            set(
-                [
-                    match.groups()[0]
-                    for match in matches
-                    if match is not None and (match.groups()[0] != "")
-                ]
-            )
-        )
+    @property
+    def index(self):
+        """Dict ``{directory_path: (file_names, dir_names)}`` listing the
+        content of every directory of the archive, computed once."""
+        if self._index is None:
+            self._index = directories_index(self.reader.namelist())
+        return self._index
 
     def list_files(self, directory):
-        return self.list_directory_components(directory, regexpr=r"%s([^/]*)$")
+        files, _ = self.index.get(self.relative_path(directory), ((), ()))
+        return sorted(files)
 
     def list_dirs(self, directory):
-        return self.list_directory_components(directory, regexpr=r"%s([^/]*)/")
+        _, dirs = self.index.get(self.relative_path(directory), ((), ()))
+        return sorted(dirs)
+
+    def list_entries(self, directory, with_stats=False):
+        """Return a list of ``(name, is_dir, size, mtime)`` for all files and
+        subdirectories of the directory, where the size and modification time
+        (read from the archive's records) are None unless ``with_stats`` is
+        True (directories have no size)."""
+        path = self.relative_path(directory)
+        files, dirs = self.index.get(path, ((), ()))
+        entries = [(name, True, None, None) for name in dirs]
+        for name in files:
+            size = mtime = None
+            if with_stats:
+                info = self.reader.NameToInfo[path + name]
+                size = info.file_size
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+            entries.append((name, False, size, mtime))
+        return entries
+
+    @staticmethod
+    def mtime(directory):
+        """Return None as the archive can't be modified by other programs
+        while the manager is open."""
+        return None
+
+    def file_size(self, fileobject, compressed=False):
+        """Return the size of the file in bytes, as recorded in the archive
+        (no decompression needed). Files not yet flushed into the archive
+        have the same compressed and uncompressed size, and files created but
+        never written have a size of 0."""
+        path = self.relative_path(fileobject)
+        if self.is_pending(path):
+            return len(self.pending_data(path))
+        info = self.zipped_info(path)
+        if info is None:  # file created but never written
+            return 0
+        return info.compress_size if compressed else info.file_size
+
+    def zipped_info(self, path):
+        """Return the ZipInfo of an already-zipped file, or None."""
+        archive = self.writer if path in self.flushed else self.reader
+        return archive.NameToInfo.get(path, None)
+
+    def is_pending(self, path):
+        """Return whether the file is in memory, not yet flushed."""
+        return (path in self.files_data) or (path in self.open_writers)
+
+    def pending_file(self, path):
+        """Return the in-memory file (or open handle) of a file not yet
+        flushed into the archive."""
+        writer = self.open_writers.get(path, None)
+        return self.files_data[path] if writer is None else writer
+
+    def pending_data(self, path):
+        """Return the bytes of a file not yet flushed into the archive."""
+        result = self.pending_file(path).getvalue()
+        if not isinstance(result, bytes):
+            result = result.encode("utf-8")
+        return result
 
     def read(self, fileobject, mode="r"):
         path = self.relative_path(fileobject).strip("/")
-        if path in self.files_data:
-            result = self.files_data[path].getvalue()
+        if self.is_pending(path):
+            result = self.pending_data(path)
         else:
-            result = self.reader.read(path)
+            return self.read_zipped(path, mode=mode)
         if (mode == "r") and hasattr(result, "decode"):
             result = result.decode("utf8")
         return result
 
+    def read_zipped(self, path, mode="r"):
+        """Return the content of an already-zipped file, using the cache."""
+        key = (path, mode)
+        if self.cache_size:
+            with self.cache_lock:
+                if key in self.cache:
+                    self.cache_hits += 1
+                    self.cache.move_to_end(key)
+                    return self.cache[key][0]
+                self.cache_misses += 1
+        archive = self.writer if path in self.flushed else self.reader
+        result = archive.read(path)
+        nbytes = len(result)  # size of the content, even when decoded
+        if mode == "r":
+            result = result.decode("utf8")
+        if self.cache_size and (nbytes <= self.cache_size):
+            with self.cache_lock:
+                if key not in self.cache:
+                    self.cache[key] = (result, nbytes)
+                    self.cache_bytes += nbytes
+                while self.cache_bytes > self.cache_size:
+                    _, (_, evicted_nbytes) = self.cache.popitem(last=False)
+                    self.cache_bytes -= evicted_nbytes
+        return result
+
+    def uncache(self, path):
+        """Remove a file's contents from the cache."""
+        with self.cache_lock:
+            for mode in ("r", "rb"):
+                entry = self.cache.pop((path, mode), None)
+                if entry is not None:
+                    self.cache_bytes -= entry[1]
+
+    def cache_stats(self):
+        """Return a dict of statistics on the cache (hits, misses...)."""
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "entries": len(self.cache),
+            "bytes": self.cache_bytes,
+            "max_bytes": self.cache_size,
+        }
+
     def write(self, fileobject, content, mode="w"):
         path = self.relative_path(fileobject)
         if self.path_exists_in_file(fileobject):
@@ -114,11 +293,26 @@ class ZipFileManager:
                 "Rewriting a file already zipped is not currently supported. "
                 "It may actually not even be possible, or in an inelegant way."
             )
+        self.uncache(path)
         if mode in ("w", "wb"):  # i.e. not append
             self.files_data.pop(path, None)  # overwrite if exists!
+            self.open_writers.pop(path, None)
         if not isinstance(content, bytes):
             content = content.encode("utf-8")
-        self.files_data[path].write(content)
+        data = self.pending_file(path)
+        if isinstance(data, StringIO):  # file currently opened in text mode
+            content = content.decode("utf-8")
+        data.write(content)
+
+    def stored_hash(self, fileobject, algo="md5"):
+        """Return the CRC32 stored in the archive for an already-zipped file
+        (if ``algo`` is "crc32"), without decompressing it. Return None in
+        any other case."""
+        path = self.relative_path(fileobject)
+        if (algo != "crc32") or self.is_pending(path):
+            return None
+        info = self.zipped_info(path)
+        return None if info is None else "%08x" % info.CRC
 
     def delete(self, directory):
         raise NotImplementedError(
@@ -135,34 +329,203 @@ class ZipFileManager:
         # the moment we create a file whose address in this directory.
 
     def path_exists_in_file(self, directory):
-        return self.relative_path(directory) in self.reader.namelist()
+        return self.zipped_info(self.relative_path(directory)) is not None
+
+    def handle_spec(self):
+        """Return the ``(manager_class, path)`` needed to reopen this file
+        tree in another process (see ``FileHandle``). Only possible for
+        archives on the disk, which are not being written (an archive has no
+        valid central directory until it is closed)."""
+        if self.source != self.path:
+            raise ValueError(
+                "Only zip archives on the disk can be reopened in other "
+                "processes, not in-memory archives."
+            )
+        if (self._writer is not None) and not self.closed:
+            raise ValueError(
+                "Files were written in the zip archive %s, which can only be "
+                "reopened once it is closed." % self.path
+            )
+        return (self.__class__, self.path)
+
+    @staticmethod
+    def source_path(path):
+        """Return the path of the archive (see ``FileHandle``)."""
+        return path
+
+    @classmethod
+    def reopen(cls, path):
+        """Return a manager reading an existing archive, without creating
+        or modifying it (see ``FileHandle``)."""
+        if not os.path.isfile(path):
+            raise IOError("No such zip archive: %s" % path)
+        return cls(path)
 
     @staticmethod
     def join_paths(*paths):
         return "/".join(*paths)
 
-    def close(self):
-        for path, data in self.files_data.items():
-            self.writer.writestr(path, data.getvalue())
-        self.writer.close()
+    def flush(self, path):
+        """Write a file from memory into the archive and free the memory."""
+        if self.closed or not self.is_pending(path):
+            return
+        self.write_member(path, self.pending_data(path))
+
+    def flush_writer(self, writer):
+        """Flush the content of a handle being closed or garbage-collected,
+        unless the file was rewritten since the handle was opened."""
+        path = writer.path
+        if self.closed or (path in self.flushed):
+            return
+        if is_current_writer(self, writer):
+            self.write_member(path, writer_data(writer))
+
+    def write_member(self, path, data):
+        """Write a file's data into the archive and free the memory."""
+        self.writer.writestr(path, data)
+        self.files_data.pop(path, None)
+        self.open_writers.pop(path, None)
+        self.flushed.add(path)
+
+    def close(self, target=None, as_memoryview=False):
+        """Flush all files into the archive and close it.
+
+        For in-memory archives, the zip data is returned as bytes, or as a
+        ``memoryview`` over the archive's buffer if ``as_memoryview`` is True
+        (no copy), or written directly into the file-like ``target`` (e.g. an
+        HTTP response) at which case nothing is returned.
+        """
+        for path in list(self.files_data) + list(self.open_writers.keys()):
+            self.flush(path)
+        if self.path == "@memory":
+            self.writer  # So that even an empty archive has valid zip data.
+        if self._writer is not None:
+            self._writer.close()
+        self.closed = True
         if hasattr(self.source, "getvalue"):
-            return self.source.getvalue()
+            if target is not None:
+                target.write(self.source.getbuffer())
+            elif as_memoryview:
+                return self.source.getbuffer()
+            else:
+                return self.source.getvalue()
 
     def open(self, fileobject, mode="a"):
 
         path = self.relative_path(fileobject)
         if mode in ("r", "rb"):
             container = {"r": StringIO, "rb": BytesIO}[mode]
-            if path in self.files_data:
-                content = self.files_data[path].getvalue()
+            if self.is_pending(path):
+                content = self.pending_data(path)
                 if mode == "r":
-                    content = content.decode()
+                    content = content.decode("utf8")
                 return container(content)
+            elif (path, mode) in self.cache:
+                return container(self.read_zipped(path, mode=mode))
+            elif mode == "rb":
+                # Decompress on the fly rather than all at once
+                archive = self.writer if path in self.flushed else self.reader
+                return archive.open(path)
             else:
                 return container(self.read(fileobject, mode=mode))
         else:
-            if mode == "w" and path not in self.files_data:
-                self.files_data[path] = StringIO()
-            elif mode == "wb" and path not in self.files_data:
-                self.files_data[path] = BytesIO()
-            return self.files_data[path]
+            if self.path_exists_in_file(fileobject):
+                raise NotImplementedError(
+                    "Rewriting a file already zipped is not currently supported."
+                )
+            self.uncache(path)
+            content = b""
+            if mode.startswith("a") and self.is_pending(path):
+                content = self.pending_data(path)
+            container = ZipMemberWriter if mode.endswith("b") else ZipMemberTextWriter
+            self.files_data.pop(path, None)
+            writer = container(self, path, content)
+            self.open_writers[path] = writer
+            return writer
+
+
+def is_current_writer(manager, writer):
+    """Return whether the handle holds the latest content of its file, i.e.
+    the file wasn't rewritten by other means since the handle was opened."""
+    current = manager.open_writers.get(writer.path, None)
+    if (current is not None) and (current is not writer):
+        return False
+    return writer.path not in manager.files_data
+
+
+def writer_data(writer):
+    """Return the content of a ZipMemberWriter or ZipMemberTextWriter as
+    bytes."""
+    data = writer.getvalue()
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    return data
+
+
+class ZipMemberWriter(BytesIO):
+    """In-memory file handle for a file of a zip archive.
+
+    The content is flushed into the archive as soon as the handle is closed
+    (or garbage-collected), so that only the files currently opened are kept
+    in memory.
+    """
+
+    def __init__(self, manager, path, content=b""):
+        BytesIO.__init__(self)
+        self.write(content)
+        self.manager = manager
+        self.path = path
+
+    def close(self):
+        if not self.closed:
+            self.manager.flush_writer(self)
+        BytesIO.close(self)
+
+
+class ZipMemberTextWriter(StringIO):
+    """Text-mode version of ZipMemberWriter."""
+
+    def __init__(self, manager, path, content=b""):
+        StringIO.__init__(self)
+        self.write(content.decode("utf-8"))
+        self.manager = manager
+        self.path = path
+
+    def close(self):
+        if not self.closed:
+            self.manager.flush_writer(self)
+        StringIO.close(self)
+
+
+class BytesView:
+    """Read-only file-like object over bytes-like data (bytes, bytearray,
+    memoryview), which doesn't copy the data."""
+
+    def __init__(self, data):
+        self.view = memoryview(data).cast("B")
+        self.position = 0
+
+    def read(self, size=-1):
+        end = len(self.view)
+        if (size is not None) and (size >= 0):
+            end = min(end, self.position + size)
+        result = self.view[self.position : end].tobytes()
+        self.position = max(self.position, end)
+        return result
+
+    def seek(self, offset, whence=0):
+        start = {0: 0, 1: self.position, 2: len(self.view)}[whence]
+        self.position = max(0, start + offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def seekable(self):
+        return True
+
+    def getbuffer(self):
+        return self.view
+
+    def getvalue(self):
+        return self.view.tobytes()
@@ -0,0 +1,264 @@
+import io
+import struct
+import zlib
+
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+LOCAL_HEADER_FORMAT = "<4sHHHHHIIIHH"
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_FORMAT)
+ZIP64_EXTRA_ID = 0x0001
+CHUNK_SIZE = 64 * 1024
+
+
+class PushbackStream:
+    """Forward-only reader over a file object, where read bytes can be
+    pushed back to be read again."""
+
+    def __init__(self, source):
+        self.source = source
+        self.buffer = b""
+
+    def read(self, size):
+        """Return up to ``size`` bytes (less only at the end of the stream)."""
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        while len(data) < size:
+            chunk = self.source.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def read_exactly(self, size):
+        data = self.read(size)
+        if len(data) < size:
+            raise EOFError("Unexpected end of the zip stream.")
+        return data
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+
+def zip64_sizes(extra, compressed_size, size):
+    """Return the sizes, read from the zip64 extra field if they overflow."""
+    while len(extra) >= 4:
+        field_id, field_length = struct.unpack("<HH", extra[:4])
+        if field_id == ZIP64_EXTRA_ID:
+            values_format = "<%dQ" % (field_length // 8)
+            values = list(struct.unpack(values_format, extra[4 : 4 + field_length]))
+            if size == 0xFFFFFFFF:
+                size = values.pop(0)
+            if compressed_size == 0xFFFFFFFF:
+                compressed_size = values.pop(0)
+            return compressed_size, size, True
+        extra = extra[4 + field_length :]
+    return compressed_size, size, False
+
+
+class ZipStreamEntryReader(io.RawIOBase):
+    """Read-only binary stream decompressing the data of one entry."""
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.stream = entry._stream
+        self.finished = False
+        self.crc = 0
+        if entry._method == 8:
+            self.decompressor = zlib.decompressobj(-15)
+        else:
+            self.decompressor = None
+            self.remaining = entry._compressed_size
+        self.pending = b""
+
+    def readable(self):
+        return True
+
+    def next_chunk(self):
+        """Return the next chunk of decompressed data (b"" at the end)."""
+        if self.decompressor is None:
+            data = self.stream.read(min(CHUNK_SIZE, self.remaining))
+            if len(data) < min(CHUNK_SIZE, self.remaining):
+                raise EOFError("Unexpected end of the zip stream.")
+            self.remaining -= len(data)
+            if self.remaining == 0:
+                self.finish()
+        else:
+            data = b""
+            while (data == b"") and not self.decompressor.eof:
+                chunk = self.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    raise EOFError("Unexpected end of the zip stream.")
+                data = self.decompressor.decompress(chunk)
+            if self.decompressor.eof:
+                self.stream.unread(self.decompressor.unused_data)
+                self.finish()
+        self.crc = zlib.crc32(data, self.crc)
+        return data
+
+    def finish(self):
+        """Read the data descriptor if any, and check the CRC."""
+        self.finished = True
+        entry = self.entry
+        if entry._has_descriptor:
+            data = self.stream.read_exactly(4)
+            if data != DESCRIPTOR_SIGNATURE:  # the signature is optional
+                self.stream.unread(data)
+            size_format = "<IQQ" if entry._zip64 else "<III"
+            size = struct.calcsize(size_format)
+            entry._crc, _, entry._size = struct.unpack(
+                size_format, self.stream.read_exactly(size)
+            )
+
+    def readinto(self, buffer):
+        while (not self.pending) and not self.finished:
+            self.pending = self.next_chunk()
+        if self.finished and not self.pending:
+            if (self.crc & 0xFFFFFFFF) != self.entry._crc:
+                raise IOError("Bad CRC-32 for file %s" % self.entry._path)
+        data, self.pending = self.pending[: len(buffer)], self.pending[len(buffer) :]
+        buffer[: len(data)] = data
+        return len(data)
+
+    def skip(self):
+        """Read the rest of the entry's data, to get to the next entry."""
+        while not self.finished:
+            self.next_chunk()
+        self.pending = b""
+
+
+class ZipStreamEntry:
+    """File-like entry of a zip stream. Its content can only be read until
+    the reader moves on to the next entry."""
+
+    _is_dir = False
+
+    def __init__(self, stream, path, method, flags, crc, compressed_size, size, zip64):
+        self._stream = stream
+        self._path = path
+        self._name = path.split("/")[-1]
+        self._method = method
+        self._has_descriptor = bool(flags & 0x08)
+        self._crc = crc
+        self._compressed_size = compressed_size
+        self._size = None if self._has_descriptor else size
+        self._zip64 = zip64
+        self._content_reader = ZipStreamEntryReader(self)
+
+    @property
+    def _extension(self):
+        return "" if "." not in self._name else self._name.split(".")[-1]
+
+    @property
+    def _name_no_extension(self):
+        return ".".join(self._name.split(".")[:-1]) or self._name
+
+    def open(self, mode="rb"):
+        """Return a stream of the file's content, in mode "r" or "rb"."""
+        if mode not in ("r", "rb"):
+            raise ValueError("Zip stream entries can only be read.")
+        handle = io.BufferedReader(self._content_reader, CHUNK_SIZE)
+        if mode == "r":
+            handle = io.TextIOWrapper(handle, encoding="utf-8")
+        return handle
+
+    def read(self, mode="r"):
+        """Return the file's content as a string (mode 'r') or bytes ('rb')."""
+        return self.open(mode=mode).read()
+
+    def copy(self, target):
+        """Copy the file's content to a flametree directory or file, chunk by
+        chunk."""
+        if target._is_dir:
+            target = target._file(self._name)
+        with self.open("rb") as source, target.open("wb") as destination:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                destination.write(chunk)
+
+    def __repr__(self):
+        return "<ZipStreamEntry %s>" % self._path
+
+
+class ZipStreamReader:
+    """Forward-only reader of the zip data arriving in a non-seekable stream
+    (a pipe, an HTTP response body, etc.).
+
+    Iterating over the reader yields the files of the archive one after the
+    other as ``ZipStreamEntry`` objects, read from their local headers as the
+    data arrives, so that huge archives can be processed in one pass with a
+    constant memory. An entry's content (``entry.read()``, ``entry.open()``)
+    must be read before going to the next entry. Directory entries are
+    skipped.
+
+    Deflated and stored files are supported, including zip64 archives and
+    deflated files with data descriptors (as written by streaming zip
+    writers). Stored files with a data descriptor can't be read this way, as
+    their size is unknown until the end of their data.
+
+    Parameters
+    ----------
+
+    source
+      A binary file object with a ``read()`` method.
+
+    Examples
+    --------
+
+    >>> for f in ZipStreamReader(sys.stdin.buffer):
+    >>>     if f._extension == "csv":
+    >>>         f.copy(root._dir("csvs"))
+    """
+
+    def __init__(self, source):
+        self.stream = PushbackStream(source)
+        self.current_entry = None
+
+    def next_entry(self):
+        """Return the next entry of the stream (or None at the end)."""
+        if self.current_entry is not None:
+            self.current_entry._content_reader.skip()
+            self.current_entry = None
+        header = self.stream.read(LOCAL_HEADER_SIZE)
+        if not header.startswith(LOCAL_HEADER_SIGNATURE):
+            # Central directory or end of the data: no more files.
+            return None
+        if len(header) < LOCAL_HEADER_SIZE:
+            raise EOFError("Unexpected end of the zip stream.")
+        (
+            _,
+            _,
+            flags,
+            method,
+            _,
+            _,
+            crc,
+            compressed_size,
+            size,
+            name_length,
+            extra_length,
+        ) = struct.unpack(LOCAL_HEADER_FORMAT, header)
+        name = self.stream.read_exactly(name_length)
+        extra = self.stream.read_exactly(extra_length)
+        name = name.decode("utf-8" if (flags & 0x800) else "cp437")
+        compressed_size, size, zip64 = zip64_sizes(extra, compressed_size, size)
+        if flags & 0x01:
+            raise NotImplementedError("Encrypted files are not supported.")
+        if method not in (0, 8):
+            raise NotImplementedError(
+                "Compression method %d is not supported (%s)" % (method, name)
+            )
+        if (method == 0) and (flags & 0x08):
+            raise NotImplementedError(
+                "Stored files with a data descriptor can't be streamed (%s)" % name
+            )
+        self.current_entry = ZipStreamEntry(
+            self.stream, name, method, flags, crc, compressed_size, size, zip64
+        )
+        return self.current_entry
+
+    def __iter__(self):
+        while True:
+            entry = self.next_entry()
+            if entry is None:
+                return
+            if entry._path.endswith("/"):
+                continue
+            yield entry
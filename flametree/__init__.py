@@ -1,8 +1,50 @@
 """ flametree/__init__.py """
 
+import importlib
+import sys
+import types
+
 # __all__ = []
 from .version import __version__
 from .Directory import Directory, File
-from .DiskFileManager import DiskFileManager
-from .ZipFileManager import ZipFileManager
 from .utils import file_tree
+
+# These classes are only imported when first used (with their dependencies,
+# e.g. zipfile or sqlite3), so that importing flametree stays fast.
+LAZY_CLASSES = (
+    "DiskFileManager",
+    "ZipFileManager",
+    "SQLiteFileManager",
+    "OverlayFileManager",
+    "ShardedZipFileManager",
+    "InstrumentedFileManager",
+    "TreeWatcher",
+    "FileHandle",
+    "ZipStreamReader",
+)
+
+
+class FlametreeModule(types.ModuleType):
+    """Module class of the flametree package, importing the classes of
+    LAZY_CLASSES from their modules on first access."""
+
+    def __getattr__(self, name):
+        if name not in LAZY_CLASSES:
+            raise AttributeError(
+                "module '%s' has no attribute '%s'" % (self.__name__, name)
+            )
+        module = importlib.import_module("." + name, self.__name__)
+        return getattr(module, name)
+
+    def __setattr__(self, name, value):
+        # Importing a module like flametree.ZipFileManager sets the module as
+        # an attribute of the package, which would hide the class.
+        if (name in LAZY_CLASSES) and isinstance(value, types.ModuleType):
+            return
+        types.ModuleType.__setattr__(self, name, value)
+
+    def __dir__(self):
+        return sorted(set(types.ModuleType.__dir__(self)).union(LAZY_CLASSES))
+
+
+sys.modules[__name__].__class__ = FlametreeModule
@@ -0,0 +1,141 @@
+import hashlib
+import zlib
+
+CHUNK_SIZE = 2 ** 20
+
+
+class Crc32Hasher:
+    """Minimal hashlib-like hasher computing a CRC32 with zlib."""
+
+    name = "crc32"
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return "%08x" % (self.value & 0xFFFFFFFF)
+
+
+def new_hasher(algo="md5"):
+    """Return a new hasher for the given algorithm name ('md5', 'sha256',
+    'crc32'... any name accepted by ``hashlib.new``)."""
+    if algo == "crc32":
+        return Crc32Hasher()
+    return hashlib.new(algo)
+
+
+def hash_stream(stream, algo="md5", chunk_size=CHUNK_SIZE):
+    """Return the hexdigest of a binary stream, read in chunks."""
+    hasher = new_hasher(algo)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class HashRecorder:
+    """Compute file hashes on the fly, as files are written.
+
+    A recorder can be attached to a file manager (``hash_recorder``
+    attribute), at which case ``File._hash`` will use the recorded digests
+    instead of reading the files again.
+
+    Parameters
+    ----------
+
+    algos
+      Name or list of names of the algorithms to compute, e.g. "md5" or
+      ``["md5", "sha256"]``.
+    """
+
+    def __init__(self, algos="md5"):
+        if isinstance(algos, str):
+            algos = [algos]
+        self.algos = list(algos)
+        self.hashers = {}
+
+    def start(self, fileobject):
+        """Start hashing a file whose content is (now) empty."""
+        self.hashers[fileobject._path] = {
+            algo: new_hasher(algo) for algo in self.algos
+        }
+
+    def discard(self, fileobject):
+        """Forget the hashes of a file whose content is no longer known."""
+        self.hashers.pop(fileobject._path, None)
+
+    def update(self, fileobject, content, mode="a"):
+        """Record some content written to the file with the given mode."""
+        if not mode.startswith("a"):
+            self.start(fileobject)
+        hashers = self.hashers.get(fileobject._path, None)
+        if hashers is None:
+            # We don't know what was in the file before this append.
+            return
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        for hasher in hashers.values():
+            hasher.update(content)
+
+    def get(self, fileobject, algo="md5"):
+        """Return the recorded hexdigest of the file, or None if unknown."""
+        hasher = self.hashers.get(fileobject._path, {}).get(algo, None)
+        return None if hasher is None else hasher.hexdigest()
+
+    def wrap(self, fileobject, handle, mode="a"):
+        """Return a version of the handle recording everything written."""
+        if ("r" in mode) or ("+" in mode):
+            self.discard(fileobject)
+            return handle
+        if not mode.startswith("a"):
+            self.start(fileobject)
+        return HashingWriter(self, fileobject, handle)
+
+
+class HashingWriter:
+    """File handle proxy feeding written data to a HashRecorder."""
+
+    def __init__(self, recorder, fileobject, handle):
+        self._recorder = recorder
+        self._fileobject = fileobject
+        self._handle = handle
+
+    def write(self, data):
+        self._recorder.update(self._fileobject, data, mode="a")
+        return self._handle.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def seek(self, *args):
+        # Writing anywhere but at the end makes the running hash invalid.
+        self._recorder.discard(self._fileobject)
+        return self._handle.seek(*args)
+
+    def truncate(self, *args):
+        self._recorder.discard(self._fileobject)
+        return self._handle.truncate(*args)
+
+    def fileno(self):
+        # Hide the file descriptor so that libraries (e.g. Pillow) do not
+        # write to it directly, bypassing the hashing.
+        import io
+
+        raise io.UnsupportedOperation("fileno")
+
+    def __getattr__(self, attr):
+        return getattr(self._handle, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *a):
+        if exc_type is not None:
+            # The content may not have been (fully) written.
+            self._recorder.discard(self._fileobject)
+        if hasattr(self._handle, "__exit__"):
+            return self._handle.__exit__(exc_type, *a)
+        self._handle.close()
@@ -1,20 +1,59 @@
 import os
-import shutil
 
-from .ZipFileManager import ZipFileManager
-from .DiskFileManager import DiskFileManager
 from .Directory import Directory
 
-import string
+# The file managers are imported when first used, so that importing flametree
+# and opening a tree only loads the modules needed for this kind of tree.
 
-printable = set(string.printable) - set("\x0b\x0c")
+ZIP_MAGIC_NUMBERS = ("PK\x03\x04", "PK\x05\x06", "PK\x07\x08")
 
 
-def is_hex(s):
-    return any(c not in printable for c in s)
+def is_zip_data(data):
+    """Return True if the string or bytes start like a zip archive.
 
+    Only the first bytes are looked at, so this is fast even for large data.
+    """
+    start = data[:4]
+    if not isinstance(start, str):
+        start = bytes(start).decode("latin-1")
+    return start in ZIP_MAGIC_NUMBERS
+
+
+def guess_kind(target):
+    """Return the kind of file tree targeted: 'zip' for a zip path, data or
+    file-like object, 'memory' for '@memory', 'sqlite' for a SQLite database
+    path, 'sharded' for a path template containing '{shard}', 'disk' for a
+    folder path."""
+    if isinstance(target, (bytes, bytearray, memoryview)) or hasattr(
+        target, "read"
+    ):
+        return "zip"
+    if target == "@memory":
+        return "memory"
+    if is_zip_data(target):  # before any test on the names in the data
+        return "zip"
+    if "{shard}" in target:
+        return "sharded"
+    if target.lower().endswith(".zip"):
+        return "zip"
+    if target.lower().endswith((".sqlite", ".sqlite3")):
+        return "sqlite"
+    return "disk"
 
-def file_tree(target, replace=False):
+
+def file_tree(
+    target,
+    replace=False,
+    hash_on_write=None,
+    kind=None,
+    instrument=False,
+    cache_size=0,
+    overlay=None,
+    shard_size=None,
+    shard_by=None,
+    atomic=False,
+    explore=True,
+):
     """Open a connection to a file tree which can be either a disk folder, a
     zip archive, or an in-memory zip archive.
 
@@ -24,19 +63,119 @@ def file_tree(target, replace=False):
     target
       Either the path to a target folder, or a zip file, or '@memory' to write
       a zip file in memory (at which case a string of the zip file is returned)
+      or a SQLite database file ending with '.sqlite' or '.sqlite3', or a path
+      template containing '{shard}' for sharded zip archives, e.g.
+      "out-{shard}.zip".
       If the target is already a flametree directory, it is returned as-is.
 
     replace
       If True, will remove the target if it already exists. If False, new files
       will be written inside the target and some files may be overwritten.
+
+    hash_on_write
+      Name or list of names of hash algorithms (e.g. "md5") to compute while
+      files are written, so that ``File._hash`` and ``Directory._manifest``
+      don't need to read the files again.
+
+    kind
+      Either "disk", "zip", "memory", "sqlite" or "sharded" to force the kind
+      of file tree rather than guessing it from the target. Zip data (bytes,
+      bytearray, memoryview, file-like objects, or strings starting with a
+      zip signature) is detected from its first bytes.
+
+    instrument
+      If True, the file manager is wrapped in an ``InstrumentedFileManager``
+      recording statistics on all operations, available with
+      ``root._file_manager.stats()``.
+
+    cache_size
+      For zip archives, maximal total size in bytes of the files' contents
+      kept in memory after being read (see ``ZipFileManager``).
+
+    overlay
+      For zip archives, either the path to a folder or "@memory". The archive
+      is then opened read-only, and all changes are written in the folder (or
+      in memory) instead (the archive must exist, and is never replaced),
+      until they are written in a new archive with
+      ``root._commit(target=new_archive_path)`` (see ``OverlayFileManager``).
+
+    shard_size, shard_by
+      For sharded zip archives, the maximal size of the files in a shard (e.g.
+      "2GB") and whether to group the files by top-level directory ("top"),
+      see ``ShardedZipFileManager``.
+
+    atomic
+      For disk folders, whether files should be written atomically, with the
+      written files being synced to the disk all at once when the tree is
+      closed or with ``root._commit()`` (see ``DiskFileManager``).
+
+    explore
+      If False, the tree is not explored when opened (which can take long for
+      very large trees), and its content can be listed page by page with
+      ``Directory._list``, or accessed with ``Directory._element_at``.
     """
     if isinstance(target, Directory):
         return target
-    if (not isinstance(target, str)) or is_hex(target):
-        return Directory(file_manager=ZipFileManager(source=target))
-    elif target == "@memory":
-        return Directory("@memory", file_manager=ZipFileManager("@memory"))
-    elif target.lower().endswith(".zip"):
-        return Directory(target, file_manager=ZipFileManager(target, replace=replace))
+    if kind is None:
+        kind = guess_kind(target)
+    if (overlay is not None) and (kind not in ("zip", "memory")):
+        raise ValueError("Overlays can only be used over zip archives.")
+    if kind in ("memory", "zip"):
+        from .ZipFileManager import ZipFileManager
+    if kind == "memory":
+        location = "@memory"
+        file_manager = ZipFileManager("@memory", cache_size=cache_size)
+    elif kind == "zip":
+        if isinstance(target, str) and not is_zip_data(target):
+            location = target
+            if overlay is not None:
+                # The archive under an overlay is only read, never replaced
+                # or created.
+                if not os.path.isfile(target):
+                    raise IOError("No such zip archive: %s" % target)
+                replace = False
+            file_manager = ZipFileManager(
+                target, replace=replace, cache_size=cache_size
+            )
+        else:
+            location = "."
+            file_manager = ZipFileManager(source=target, cache_size=cache_size)
+    elif kind == "sqlite":
+        from .SQLiteFileManager import SQLiteFileManager
+
+        location = target
+        file_manager = SQLiteFileManager(target, replace=replace)
+    elif kind == "sharded":
+        from .ShardedZipFileManager import ShardedZipFileManager
+
+        location = target
+        file_manager = ShardedZipFileManager(
+            target, shard_size=shard_size, shard_by=shard_by, replace=replace
+        )
+    elif kind == "disk":
+        from .DiskFileManager import DiskFileManager
+
+        location, file_manager = target, DiskFileManager(target, atomic=atomic)
     else:
-        return Directory(target, file_manager=DiskFileManager(target))
+        raise ValueError("Unknown file tree kind: %s" % kind)
+    if overlay is not None:
+        from .OverlayFileManager import OverlayFileManager
+
+        if overlay == "@memory":
+            from .SQLiteFileManager import SQLiteFileManager
+
+            upper = SQLiteFileManager(":memory:")
+        else:
+            from .DiskFileManager import DiskFileManager
+
+            upper = DiskFileManager(overlay)
+        file_manager = OverlayFileManager(file_manager, upper)
+    if hash_on_write is not None:
+        from .hashing import HashRecorder
+
+        file_manager.hash_recorder = HashRecorder(hash_on_write)
+    if instrument:
+        from .InstrumentedFileManager import InstrumentedFileManager
+
+        file_manager = InstrumentedFileManager(file_manager)
+    return Directory(location, file_manager=file_manager, explore=explore)
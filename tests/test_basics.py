@@ -1,6 +1,13 @@
 import os
 import sys
-from flametree import file_tree, DiskFileManager, ZipFileManager
+from flametree import (
+    file_tree,
+    DiskFileManager,
+    ZipFileManager,
+    InstrumentedFileManager,
+    ZipStreamReader,
+    FileHandle,
+)
 import pytest
 
 PYTHON3 = sys.version_info[0] == 3
@@ -167,3 +174,594 @@ def test_matplotlib_writer(tmpdir):
         fig.savefig(fig_dir._file("fig.pdf").open("wb"), format="pdf")
     assert set([f._name for f in root._all_files]) == set(["fig.png", "fig.pdf"])
     assert os.path.exists(os.path.join(folder_path, "figures", "fig.pdf"))
+
+
+def test_hashes(tmpdir):
+    import hashlib
+    import zlib
+
+    content = "bla bla bla"
+    md5 = hashlib.md5(content.encode()).hexdigest()
+    crc = "%08x" % zlib.crc32(content.encode())
+
+    root = file_tree(os.path.join(str(tmpdir), "folder"))
+    root._dir("texts")._file("bla.txt").write(content)
+    assert root.texts.bla_txt._hash() == md5
+    assert root.texts.bla_txt._hash("crc32") == crc
+    assert root._manifest(workers=2) == {"texts/bla.txt": md5}
+    assert root._manifest(as_text=True) == "%s  texts/bla.txt\n" % md5
+
+    # Hashes computed while writing
+    root = file_tree(os.path.join(str(tmpdir), "folder2"), hash_on_write="md5")
+    root._file("bla.txt").write("bla bla")
+    root.bla_txt.write(" bla")
+    with root._file("bli.txt").open("wb") as f:
+        f.write(content.encode())
+    assert root._file_manager.hash_recorder.get(root.bla_txt) == md5
+    assert root._manifest() == {"bla.txt": md5, "bli.txt": md5}
+
+    # CRC32 stored in zip archives
+    zip_path = os.path.join(str(tmpdir), "archive.zip")
+    with file_tree(zip_path) as root:
+        root._file("bla.txt").write(content)
+        assert root.bla_txt._hash() == md5
+    root = file_tree(zip_path)
+    assert root._file_manager.stored_hash(root.bla_txt, "crc32") == crc
+    assert root._manifest("crc32") == {"bla.txt": crc}
+    assert root._manifest("md5", workers=2) == {"bla.txt": md5}
+
+
+def test_sizes(tmpdir):
+    for target in [os.path.join(str(tmpdir), "folder"), "@memory"]:
+        root = file_tree(target)
+        root._dir("texts")._dir("shorts")._file("bla.txt").write("bla bla bla")
+        root.texts._file("blu.txt").write(100 * "blu ")
+        assert root.texts.shorts.bla_txt._size == 11
+        assert root._du() == 411
+        assert root._tree_view(show_sizes=True).split("\n") == [
+            "texts/ (411 B)",
+            "  shorts/ (11 B)",
+            "    bla.txt (11 B)",
+            "  blu.txt (400 B)",
+        ]
+        data = root._close()
+
+    # Sizes computed while a file is written are forgotten at closing
+    for target, size in [(os.path.join(str(tmpdir), "folder"), 411), ("@memory", 0)]:
+        root = file_tree(target)
+        handle = root._file("a.txt").open("w")
+        assert root._du() == size
+        handle.write("abcdef")
+        handle.close()
+        assert (root.a_txt._size, root._du()) == (6, size + 6)
+        root._close()
+
+    # Directory entries are only cached for size requests
+    root = file_tree(os.path.join(str(tmpdir), "folder"))
+    assert root._file_manager.entries_cache == {}
+
+    root = file_tree(data)
+    assert root._du() == 411
+    assert root.texts.blu_txt._size == 400
+    assert root._du(compressed=True) < 100
+
+    # Directory totals are computed once, until their subtree changes
+    root = file_tree(os.path.join(str(tmpdir), "chain"), instrument=True)
+    directory = root
+    for i in range(30):
+        directory = directory._dir("d%d" % i)
+        directory._file("f.txt").write("x")
+    root._tree_view(show_sizes=True)
+    assert root._file_manager.calls["file_size"] <= 60
+    root._file_manager.reset_stats()
+    assert root._du() == 30
+    assert root._file_manager.calls["file_size"] == 0
+    directory.f_txt.write("yy")
+    directory._file("new.txt").write("z")
+    assert (root._du(), root.d0._du(), directory._du()) == (33, 33, 4)
+    root._dir("d0")  # replaces d0
+    assert root._du() == 0
+
+    root = file_tree(data)
+    # Files created but not written yet have a size of 0
+    root._file("empty.txt")
+    assert root.empty_txt._size == 0
+    assert root._du() == 411
+    assert root._list(sort_by="size")[1] == root.empty_txt
+
+
+def test_zip_members_flushed_on_close(tmpdir):
+    zip_path = os.path.join(str(tmpdir), "archive.zip")
+    root = file_tree(zip_path)
+    manager = root._file_manager
+    for i in range(3):
+        with root._dir("pdfs", replace=False)._file("%d.pdf" % i).open("wb") as f:
+            f.write(b"%PDF " + 1000 * b"x")
+        assert len(manager.files_data) == 0
+    text_handle = root._file("notes.txt").open("w")
+    text_handle.write("some notes")
+    assert list(manager.open_writers) == ["notes.txt"]
+    assert root.pdfs["1.pdf"].read("rb") == b"%PDF " + 1000 * b"x"
+    assert root.pdfs["1.pdf"]._size == 1005
+    with pytest.raises(NotImplementedError):
+        root.pdfs["1.pdf"].open("wb")
+    root._close()
+
+    root = file_tree(zip_path)
+    assert root._filenames == ["notes.txt"]
+    assert root.notes_txt.read() == "some notes"
+    assert root.pdfs._filenames == ["0.pdf", "1.pdf", "2.pdf"]
+
+    # Handles dropped without being closed (e.g. passed to a library's
+    # writer) are flushed when garbage-collected.
+    root = file_tree(os.path.join(str(tmpdir), "unclosed.zip"))
+    manager = root._file_manager
+    for i in range(20):
+        root._file("%d.bin" % i).open("wb").write(b"data %d" % i)
+    assert len(manager.open_writers) == len(manager.files_data) == 0
+    assert len(manager.flushed) == 20
+    assert root["7.bin"].read("rb") == b"data 7"
+    root._close()
+    root = file_tree(os.path.join(str(tmpdir), "unclosed.zip"))
+    assert len(root._filenames) == 20
+    assert root["19.bin"].read("rb") == b"data 19"
+
+
+def test_memory_zip_close_without_copy():
+    import io
+
+    def make_zip():
+        root = file_tree("@memory")
+        root._file("test.txt").write("bla bla bla")
+        return root
+
+    data = make_zip()._close()
+    view = make_zip()._close(as_memoryview=True)
+    assert isinstance(view, memoryview)
+    assert len(view) == len(data)
+    assert file_tree(bytes(view)).test_txt.read() == "bla bla bla"
+    stream = io.BytesIO()
+    assert make_zip()._close(target=stream) is None
+    assert file_tree(stream.getvalue()).test_txt.read() == "bla bla bla"
+
+
+def test_zip_data_detection(tmpdir):
+    root = file_tree("@memory")
+    root._file("test.txt").write("bla bla bla")
+    data = root._close()
+    for source in [data, bytearray(data), memoryview(data), data.decode("latin-1")]:
+        root = file_tree(source)
+        assert root._file_manager.__class__ == ZipFileManager
+        assert root.test_txt.read() == "bla bla bla"
+    # bytes-like data is only copied when the archive is modified
+    root = file_tree(bytearray(data))
+    root._file("test2.txt").write("bli bli")
+    new_data = root._close()
+    assert sorted(file_tree(new_data)._filenames) == ["test.txt", "test2.txt"]
+
+    path = os.path.join(str(tmpdir), "archive.data")
+    root = file_tree(path, kind="zip")
+    assert root._file_manager.__class__ == ZipFileManager
+    root = file_tree(os.path.join(str(tmpdir), "d\xe9j\xe0_vu"))
+    assert root._file_manager.__class__ == DiskFileManager
+    with pytest.raises(ValueError):
+        file_tree(path, kind="cloud")
+
+
+def test_zip_stream_reader(tmpdir):
+    import io
+    import zipfile
+
+    class Pipe:
+        """Non-seekable stream, returning data in small pieces."""
+
+        def __init__(self, data=b""):
+            self.data = io.BytesIO(data)
+
+        def read(self, size=-1):
+            return self.data.read(min(size, 1000) if size > 0 else size)
+
+        def write(self, data):
+            return self.data.write(data)
+
+        def flush(self):
+            pass
+
+    big_data = os.urandom(100000)
+    pipe = Pipe()  # the zip writer adds data descriptors when not seekable
+    with zipfile.ZipFile(pipe, "w", compression=zipfile.ZIP_DEFLATED) as writer:
+        writer.writestr("texts/bla.txt", "bla bla bla")
+        writer.writestr("texts/", b"")
+        with writer.open("data/big.bin", "w", force_zip64=True) as f:
+            f.write(big_data)
+        writer.writestr("empty.txt", "")
+    stored = io.BytesIO()
+    with zipfile.ZipFile(stored, "w") as writer:
+        writer.writestr("stored.txt", "bli bli")
+
+    entries = ZipStreamReader(Pipe(pipe.data.getvalue()))
+    assert [f._path for f in entries] == ["texts/bla.txt", "data/big.bin", "empty.txt"]
+    root = file_tree(os.path.join(str(tmpdir), "out"))
+    for f in ZipStreamReader(Pipe(pipe.data.getvalue())):
+        if f._extension == "bin":
+            f.copy(root._dir("bins"))
+    assert root.bins.big_bin.read("rb") == big_data
+    entries = ZipStreamReader(Pipe(stored.getvalue()))
+    assert [f.read() for f in entries] == ["bli bli"]
+
+
+def test_paginated_listing(tmpdir):
+    dir_path = os.path.join(str(tmpdir), "folder")
+    zip_path = os.path.join(str(tmpdir), "archive.zip")
+    for target in [dir_path, zip_path]:
+        with file_tree(target) as root:
+            root._dir("subdir")._file("a.txt").write("a")
+            for i in range(20):
+                root._file("file_%02d.txt" % i).write((20 - i) * "x")
+            root._file("data.csv").write("1,2")
+        root = file_tree(target, explore=False)
+        page = root._list(offset=1, limit=3)
+        assert [e._name for e in page] == ["data.csv", "file_00.txt", "file_01.txt"]
+        assert len(root._dict) == 3  # Only the page's elements were created
+        assert page[0].read() == "1,2"
+        page = root._list(limit=2, sort_by="size")
+        assert [e._name for e in page] == ["subdir", "file_19.txt"]
+        assert page[0]._list()[0].read() == "a"
+        page = root._list(limit=2, sort_by="size", pattern="*.txt", reverse=True)
+        assert [e._name for e in page] == ["file_00.txt", "file_01.txt"]
+        assert len(root._list(offset=5, pattern="file_*")) == 15
+        assert [e._name for e in root._list(limit=2, reverse=True)] == [
+            "subdir",
+            "file_19.txt",
+        ]
+        # Only one sorted listing per criterion, and the last filtered one
+        assert len(root._listings) == 3
+        root._file("new.txt").write("new")
+        assert [e._name for e in root._list(pattern="n*")] == ["new.txt"]
+        root._close()
+
+
+def test_instrumentation(tmpdir):
+    events = []
+    for target in [os.path.join(str(tmpdir), "folder"), "@memory"]:
+        root = file_tree(target, instrument=True)
+        manager = root._file_manager
+        assert manager.__class__ == InstrumentedFileManager
+        manager.add_hook(lambda operation, duration, nbytes: events.append(operation))
+        root._dir("texts")._file("bla.txt").write("bla bla bla")
+        with root.texts._file("bli.txt").open("w") as f:
+            f.write("bli bli")
+        assert root.texts.bla_txt.read() == "bla bla bla"
+        with root.texts.bli_txt.open("r") as f:
+            assert f.read() == "bli bli"
+        stats = manager.stats()
+        assert stats["calls"]["write"] == 1
+        assert stats["calls"]["open"] == 2
+        assert stats["bytes_written"] == 18
+        assert stats["bytes_read"] == 18
+        assert stats["directories_listed"] == 2
+        assert "write" in events
+
+        # Text is counted in bytes, and paged listings count as listings
+        root._file("été.txt").write("été")
+        assert manager.stats()["bytes_written"] == 18 + 5
+        root._list(limit=1)
+        assert manager.stats()["directories_listed"] == 3
+
+        manager.enabled = False
+        root.texts.bla_txt.read()
+        assert manager.stats()["calls"]["read"] == 1
+        root._close()
+
+    root = file_tree(":memory:", kind="sqlite", instrument=True)
+    root._file("bla.txt").write("bla")
+    assert [f._name for f in root._list()] == ["bla.txt"]
+    assert not hasattr(root._file_manager, "list_entries")
+
+
+def test_zip_cache():
+    root = file_tree("@memory")
+    root._file("template.txt").write("Dear %s")
+    root._file("big.txt").write(1000 * "x")
+    data = root._close()
+
+    root = file_tree(data, cache_size=100)
+    manager = root._file_manager
+    for i in range(3):
+        assert root.template_txt.read() == "Dear %s"
+        assert root.big_txt.read() == 1000 * "x"
+    assert root.template_txt.read("rb") == b"Dear %s"
+    with root.template_txt.open("rb") as f:
+        assert f.read() == b"Dear %s"
+    stats = manager.cache_stats()
+    assert (stats["hits"], stats["misses"]) == (3, 5)
+    assert (stats["entries"], stats["bytes"]) == (2, 14)
+    root._file("new.txt").write("bla")
+    manager.uncache("template.txt")
+    assert manager.cache_stats()["bytes"] == 0
+
+    # Files rewritten before being flushed are read with their new content
+    root._file("pending.txt").write("old")
+    assert root.pending_txt.read() == "old"
+    root.pending_txt.write("new", mode="w")
+    assert root.pending_txt.read() == "new"
+    stats = manager.cache_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (3, 5, 0)
+
+    # The cache size is counted in bytes, also for decoded text
+    root = file_tree("@memory")
+    root._file("accents.txt").write(40 * "é")  # 80 bytes
+    root = file_tree(root._close(), cache_size=100)
+    assert root.accents_txt.read() == 40 * "é"
+    assert root.accents_txt.read("rb") == 40 * "é".encode("utf-8")
+    stats = root._file_manager.cache_stats()
+    assert (stats["entries"], stats["bytes"]) == (1, 80)
+
+    # Nothing is cached or counted when the cache is disabled
+    root = file_tree("@memory")
+    root._file("empty.txt").write("")
+    root = file_tree(root._close())
+    assert root.empty_txt.read() == ""
+    stats = root._file_manager.cache_stats()
+    assert (stats["misses"], stats["entries"]) == (0, 0)
+
+
+def test_refresh(tmpdir):
+    import shutil
+    import time
+
+    dir_path = os.path.join(str(tmpdir), "folder")
+    root = file_tree(dir_path)
+    root._dir("results")._file("a.txt").write("a")
+    root.results._file("b.txt").write("b")
+    assert root._refresh() == ([], [])
+
+    # Other programs add and remove files
+    time.sleep(0.01)
+    os.remove(os.path.join(dir_path, "results", "a.txt"))
+    os.makedirs(os.path.join(dir_path, "results", "new", "sub"))
+    with open(os.path.join(dir_path, "results", "new", "sub", "c.txt"), "w") as f:
+        f.write("c")
+    added, removed = root._refresh()
+    assert [e._name for e in added] == ["new"]
+    assert [e._name for e in removed] == ["a.txt"]
+    assert not hasattr(root.results, "a_txt")
+    assert root.results.new.sub.c_txt.read() == "c"
+
+    # Files deleted between the listing and the refresh are not recreated
+    time.sleep(0.01)
+    with open(os.path.join(dir_path, "results", "d.txt"), "w") as f:
+        f.write("d")
+    manager = root._file_manager
+    list_files = manager.list_files
+    manager.list_files = lambda d: list_files(d) + ["ghost.txt"]
+    added, removed = root.results._refresh(recursive=False)
+    manager.list_files = list_files
+    assert [e._name for e in added] == ["d.txt", "ghost.txt"]
+    assert not os.path.exists(os.path.join(dir_path, "results", "ghost.txt"))
+    root.results._forget(root.results["ghost.txt"])
+
+    # The watcher refreshes the tree in the background
+    changes = []
+    with root._watch(interval=0.01, callback=lambda a, r: changes.append((a, r))):
+        shutil.rmtree(os.path.join(dir_path, "results", "new"))
+        for i in range(200):
+            if changes:
+                break
+            time.sleep(0.01)
+    assert [e._name for e in changes[0][1]] == ["new"]
+    assert root.results._dirnames == []
+
+    # Errors are reported and the watcher keeps running
+    changes, errors = [], []
+
+    def callback(added, removed):
+        changes.append(added)
+        if len(changes) == 1:
+            raise ValueError("error in the callback")
+
+    with root._watch(interval=0.01, callback=callback, error_callback=errors.append):
+        for name in ["e.txt", "f.txt"]:
+            time.sleep(0.02)
+            with open(os.path.join(dir_path, "results", name), "w") as f:
+                f.write(name)
+            for i in range(200):
+                with root._lock:  # the tree is not modified while iterating
+                    if name in [f._name for f in root.results._files]:
+                        break
+                time.sleep(0.01)
+    assert [str(error) for error in errors] == ["error in the callback"]
+    assert "f.txt" in root.results._filenames
+
+
+def _read_handle(handle):
+    return handle._name, handle.read()
+
+
+def test_file_handles(tmpdir):
+    import pickle
+    from concurrent.futures import ProcessPoolExecutor
+
+    zip_path = os.path.join(str(tmpdir), "archive.zip")
+    for target in [os.path.join(str(tmpdir), "folder"), zip_path]:
+        with file_tree(target) as root:
+            root._dir("texts")._dir("shorts")._file("bla.txt").write("bla bla")
+            root.texts._file("blu.txt").write("blu blu")
+        root = file_tree(target)
+        handle = root.texts.shorts.bla_txt._handle()
+        assert handle.path == "texts/shorts/bla.txt"
+        assert len(pickle.dumps(handle)) < 300 + len(target)
+        assert pickle.loads(pickle.dumps(handle)).read() == "bla bla"
+        with ProcessPoolExecutor(2) as executor:
+            results = sorted(executor.map(_read_handle, root._handles()))
+        assert results == [("bla.txt", "bla bla"), ("blu.txt", "blu blu")]
+
+    # Handles see the files added to the archive after they were resolved
+    with file_tree(zip_path) as root:
+        root._file("b.txt").write("bbb")
+    root = file_tree(zip_path)
+    assert root.b_txt._handle().read() == "bbb"
+
+    # Missing trees are not created when reopened
+    missing_path = os.path.join(str(tmpdir), "missing.zip")
+    handle = FileHandle((ZipFileManager, missing_path), "a.txt")
+    with pytest.raises(IOError):
+        handle.read()
+    assert not os.path.exists(missing_path)
+
+    with pytest.raises(ValueError):
+        file_tree("@memory")._file("test.txt")._handle()
+
+    # Archives being written can't be reopened until they are closed
+    root = file_tree(zip_path)
+    with root._file("c.txt").open("w") as f:
+        f.write("ccc")
+    with pytest.raises(ValueError):
+        root.texts.blu_txt._handle()
+    with pytest.raises(ValueError):
+        list(root._map(_count_commas, executor="process"))
+    root._close()
+    assert file_tree(zip_path).c_txt._handle().read() == "ccc"
+
+
+def _count_commas(f):
+    return f._name, f.read().count(",")
+
+
+def _count_reopened_roots(f):
+    from flametree.FileHandle import _ROOTS
+
+    return len(_ROOTS)
+
+
+def test_map(tmpdir):
+    zip_path = os.path.join(str(tmpdir), "archive.zip")
+    for target in [os.path.join(str(tmpdir), "folder"), zip_path]:
+        with file_tree(target) as root:
+            for i in range(10):
+                root._dir("data", replace=False)._file("%d.csv" % i).write(i * ",")
+            root._file("Readme.md").write(",,,")
+        root = file_tree(target)
+        expected = [("%d.csv" % i, i) for i in range(10)]
+        for executor in ["thread", "process"]:
+            results = root._map(
+                _count_commas, pattern="*.csv", workers=2, executor=executor
+            )
+            assert sorted(results) == expected
+        assert len(list(root._map(_count_commas))) == 11
+
+    # Workers don't inherit the trees reopened by the parent process
+    for target in [os.path.join(str(tmpdir), "folder"), zip_path]:
+        file_tree(target).Readme_md._handle().read()
+    with file_tree(zip_path) as root:
+        root._file("new.csv").write(",")
+    root = file_tree(zip_path)
+    results = root._map(_count_reopened_roots, pattern="new.csv", executor="process")
+    assert list(results) == [1]
+
+
+def test_atomic_writes(tmpdir):
+    dir_path = os.path.join(str(tmpdir), "folder")
+    with file_tree(dir_path, atomic=True) as root:
+        manager = root._file_manager
+        root._dir("texts")._file("bla.txt").write("bla bla")
+        root.texts.bla_txt.write(" bla")
+        assert root.texts.bla_txt.read() == "bla bla bla"
+        handle = root.texts._file("bli.txt").open("w")
+        handle.write("bli bli")
+        assert root.texts.bli_txt.read() == ""  # not replaced yet
+        handle.close()
+        assert root.texts.bli_txt.read() == "bli bli"
+
+        # An error while writing leaves the file untouched
+        with pytest.raises(ZeroDivisionError):
+            with root.texts.bli_txt.open("w") as f:
+                f.write("something else")
+                1 / 0
+        assert root.texts.bli_txt.read() == "bli bli"
+        assert [f._name for f in root.texts._list()] == ["bla.txt", "bli.txt"]
+
+        # The files are only replaced at the commit
+        texts_path = os.path.join(dir_path, "texts")
+        assert len(manager.pending_files) == 2
+        with open(os.path.join(texts_path, "bla.txt")) as f:
+            assert f.read() == ""
+        root._commit()
+        assert len(manager.pending_files) == 0
+        assert sorted(os.listdir(texts_path)) == ["bla.txt", "bli.txt"]
+        with open(os.path.join(texts_path, "bla.txt")) as f:
+            assert f.read() == "bla bla bla"
+        root._file("unclosed.txt").open("w").write("closed with the tree")
+
+        # Recreating an existing file doesn't empty it before the new content
+        # is written.
+        def compute():
+            raise ZeroDivisionError()
+
+        with pytest.raises(ZeroDivisionError):
+            root.texts._file("bla.txt").write(compute())
+        root._commit()
+        with open(os.path.join(texts_path, "bla.txt")) as f:
+            assert f.read() == "bla bla bla"
+        root.texts._file("bla.txt").write("new bla")
+        assert root.texts.bla_txt.read() == "new bla"
+    assert root.unclosed_txt.read() == "closed with the tree"
+
+    # Files still open when the tree exits on an error are discarded, and
+    # the files already closed are replaced.
+    for options in [dict(), dict(instrument=True)]:
+        with pytest.raises(ZeroDivisionError):
+            with file_tree(dir_path, atomic=True, **options) as root:
+                root._file("complete.txt").write("complete")
+                root.complete_txt.open("w").write("part")
+                root._file("done.txt").write("done")
+                manager = root._file_manager
+                1 / 0
+        assert root.complete_txt.read() == "complete"
+        assert root.done_txt.read() == "done"
+        assert len(manager.pending_files) == 0
+        assert not [name for name in os.listdir(dir_path) if name.endswith(".tmp")]
+
+    # Errors are also handled through hashing and instrumentation wrappers
+    for options in [dict(hash_on_write="md5"), dict(instrument=True)]:
+        root = file_tree(dir_path, atomic=True, **options)
+        root._file("wrapped.txt").write("original")
+        with pytest.raises(ZeroDivisionError):
+            with root.wrapped_txt.open("w") as f:
+                f.write("partial")
+                1 / 0
+        assert root.wrapped_txt.read() == "original"
+        root._close()
+
+
+IMPORT_TIME_BUDGET = 0.5  # seconds, generous to avoid failures on slow machines
+
+IMPORT_BENCHMARK = """
+import json, sys, time
+before = set(sys.modules)
+t0 = time.perf_counter()
+import flametree
+import_time = time.perf_counter() - t0
+flametree.file_tree(sys.argv[1])
+print(json.dumps([import_time, sorted(set(sys.modules) - before)]))
+"""
+
+
+def test_import_time(tmpdir):
+    import json
+    import subprocess
+    import flametree
+
+    package_dir = os.path.dirname(os.path.dirname(flametree.__file__))
+    env = dict(os.environ, PYTHONPATH=package_dir)
+    output = subprocess.check_output(
+        [sys.executable, "-c", IMPORT_BENCHMARK, os.path.join(str(tmpdir), "d")],
+        env=env,
+    )
+    import_time, new_modules = json.loads(output.decode().splitlines()[-1])
+    assert import_time < IMPORT_TIME_BUDGET
+    # Opening a disk folder doesn't load the other back-ends or heavy modules
+    for module in ["zipfile", "sqlite3", "shutil", "tempfile", "hashlib", "re"]:
+        assert module not in new_modules
+    assert "flametree.ZipFileManager" not in new_modules
+    assert flametree.ZipFileManager.__name__ == "ZipFileManager"
@@ -0,0 +1,91 @@
+import os
+import zipfile
+from io import BytesIO
+
+import pytest
+from flametree import file_tree, OverlayFileManager
+
+
+def make_archive(path):
+    with file_tree(path) as root:
+        root._file("Readme.md").write("This is a test zip")
+        root._dir("texts")._dir("shorts")._file("bla.txt").write("bla bla bla")
+        root.texts.shorts._file("bli.txt").write(100 * "bli ")
+        root.texts._dir("longs")._file("blu.txt").write(1000 * "blu ")
+
+
+def test_overlay(tmpdir):
+    zip_path = os.path.join(str(tmpdir), "archive.zip")
+    make_archive(zip_path)
+    with open(zip_path, "rb") as f:
+        original_data = f.read()
+
+    for upper in [os.path.join(str(tmpdir), "changes"), "@memory"]:
+        root = file_tree(zip_path, overlay=upper)
+        assert root._file_manager.__class__ == OverlayFileManager
+        assert root.texts.shorts.bla_txt.read() == "bla bla bla"
+
+        root.texts.shorts.bla_txt.write(" bla")  # copied from the archive
+        root.texts.shorts._file("new.txt").write("new")
+        root.texts.shorts.bli_txt.delete()
+        root.texts.longs._delete()
+        root.texts._dir("longs")._file("other.txt").write("other")
+        assert root.texts.shorts.bla_txt.read() == "bla bla bla bla"
+
+        # Reopening the overlay shows the same tree
+        root = file_tree(zip_path, overlay=upper) if upper != "@memory" else root
+        assert sorted(root.texts.shorts._filenames) == ["bla.txt", "new.txt"]
+        assert root.texts.longs._filenames == ["other.txt"]
+
+        new_zip_path = os.path.join(str(tmpdir), "new_archive.zip")
+        root._commit(target=new_zip_path)
+        root._close()
+        with open(zip_path, "rb") as f:
+            assert f.read() == original_data
+        assert zipfile.ZipFile(new_zip_path).testzip() is None
+        root = file_tree(new_zip_path)
+        assert set(f._path[len(new_zip_path) + 1 :] for f in root._all_files) == set(
+            [
+                "Readme.md",
+                "texts/shorts/bla.txt",
+                "texts/shorts/new.txt",
+                "texts/longs/other.txt",
+            ]
+        )
+        assert root.Readme_md.read() == "This is a test zip"
+        assert root.texts.shorts.bla_txt.read() == "bla bla bla bla"
+        root._close()
+
+    # Replacing the base archive
+    root = file_tree(zip_path, overlay="@memory")
+    root._file("Readme.md").write("New readme")
+    root._commit()
+    assert root.Readme_md.read() == "New readme"
+    root._close()
+    root = file_tree(zip_path)
+    assert root.Readme_md.read() == "New readme"
+    assert root.texts.longs.blu_txt.read() == 1000 * "blu "
+
+    # Archives not on the disk can only be committed to a target
+    with open(zip_path, "rb") as f:
+        root = file_tree(f.read(), overlay="@memory")
+    root._file("new.txt").write("new")
+    with pytest.raises(ValueError):
+        root._commit()
+    new_data = BytesIO()
+    root._commit(target=new_data)
+    assert file_tree(new_data.getvalue()).new_txt.read() == "new"
+    assert not os.path.exists("..tmp")
+
+    # Overlays are only possible over zip archives
+    with pytest.raises(ValueError):
+        file_tree(os.path.join(str(tmpdir), "folder"), overlay="@memory")
+    assert not os.path.exists(os.path.join(str(tmpdir), "folder"))
+
+    # The archive under an overlay is never replaced, nor created
+    root = file_tree(zip_path, overlay="@memory", replace=True)
+    assert root.Readme_md.read() == "New readme"
+    missing_path = os.path.join(str(tmpdir), "missing.zip")
+    with pytest.raises(IOError):
+        file_tree(missing_path, overlay="@memory")
+    assert not os.path.exists(missing_path)
@@ -0,0 +1,80 @@
+import os
+import json
+import zlib
+from flametree import file_tree, ShardedZipFileManager
+
+
+def test_sharded_zip(tmpdir):
+    template = os.path.join(str(tmpdir), "out-{shard}.zip")
+    with file_tree(template, shard_size="2kB") as root:
+        assert root._file_manager.__class__ == ShardedZipFileManager
+        for i in range(10):
+            root._dir("data", replace=False)._file("%d.txt" % i).write(500 * "x")
+        with root._dir("figures")._file("fig.png").open("wb") as f:
+            f.write(b"PNG" + 100 * b"\x00")
+    assert sorted(os.listdir(str(tmpdir))) == [
+        "out-0.zip",
+        "out-1.zip",
+        "out-2.zip",
+        "out-index.json",
+    ]
+
+    root = file_tree(template)
+    manager = root._file_manager
+    assert sorted(root._dirnames) == ["data", "figures"]
+    assert len(root.data._files) == 10
+    assert root._du() == 5103
+    assert manager.readers == {}  # sizes come from the index
+    assert root.data["7.txt"].read() == 500 * "x"
+    assert root.figures.fig_png.read("rb") == b"PNG" + 100 * b"\x00"
+    assert len(manager.readers) == 2
+
+    # Appending creates new shards
+    root._dir("more")._file("new.txt").write("new")
+    assert root.more._file("empty.txt")._size == 0
+    root._close()
+    root = file_tree(template)
+    assert root.more.new_txt.read() == "new"
+    with open(os.path.join(str(tmpdir), "out-index.json")) as f:
+        assert len(json.load(f)["shards"]) == 4
+
+
+def test_sharded_zip_by_top_directory(tmpdir):
+    template = os.path.join(str(tmpdir), "out-{shard}.zip")
+    with file_tree(template, shard_by="top") as root:
+        for name in ["a", "b", "c"]:
+            root._dir(name)._dir("sub")._file("f.txt").write(name)
+        root._file("Readme.md").write("readme")
+    root = file_tree(template)
+    assert sorted(f._name for f in root._all_files) == ["Readme.md"] + 3 * ["f.txt"]
+    assert len(set(shard for shard, size in root._file_manager.files.values())) == 4
+    root = file_tree(template, replace=True)
+    assert root._all_files == []
+
+
+def test_zip_data_with_shard_in_names():
+    root = file_tree("@memory")
+    root._file("out-{shard}.txt").write("not sharded")
+    data = root._close().decode("latin-1")
+    assert file_tree(data).out__shard__txt.read() == "not sharded"
+
+
+def test_sharded_zip_streaming(tmpdir):
+    template = os.path.join(str(tmpdir), "out-{shard}.zip")
+    root = file_tree(template, shard_size=1000)
+    manager = root._file_manager
+    for i in range(10):
+        with root._dir("data", replace=False)._file("%d.bin" % i).open("wb") as f:
+            f.write(i * b"\x00" + 400 * b"\x01")
+        assert len(manager.files_data) == 0  # streamed into the shards
+        assert len(manager.writing) <= 2 * manager.workers
+    manager.wait()
+    assert len(manager.shards) == 5
+    assert os.path.exists(template.format(shard=0))
+    content = 3 * b"\x00" + 400 * b"\x01"
+    assert root.data["3.bin"].read("rb") == content
+    assert root.data["3.bin"]._hash("crc32") == "%08x" % zlib.crc32(content)
+    root._close()
+    root = file_tree(template)
+    assert root._du() == 4045
+    assert root.data["9.bin"].read("rb") == 9 * b"\x00" + 400 * b"\x01"
@@ -0,0 +1,52 @@
+import os
+import pickle
+from flametree import file_tree, SQLiteFileManager
+import pytest
+
+
+def test_sqlite(tmpdir):
+    db_path = os.path.join(str(tmpdir), "results.sqlite")
+    with file_tree(db_path) as root:
+        assert root._file_manager.__class__ == SQLiteFileManager
+        root._file("Readme.md").write("This is a test database")
+        root._dir("texts")._dir("shorts")._file("bla.txt").write("bla bla bla")
+        root.texts.shorts._file("bli.txt").write("bli bli")
+        root.texts.shorts.bli_txt.write(" bli")
+        with root.texts._file("data.bin").open("wb") as f:
+            f.write(b"\x00\x01\x02")
+        root.texts._file("unclosed.txt").open("w").write("flushed on close")
+
+    root = file_tree(db_path)
+    assert set(f._name for f in root._all_files) == set(
+        ["Readme.md", "bla.txt", "bli.txt", "data.bin", "unclosed.txt"]
+    )
+    assert root.texts.shorts.bli_txt.read() == "bli bli bli"
+    assert root.texts.data_bin.read("rb") == b"\x00\x01\x02"
+    assert root.texts.unclosed_txt.read() == "flushed on close"
+    assert root.texts.shorts.bla_txt._size == 11
+    with root.texts.shorts.bla_txt.open("r") as f:
+        assert f.read() == "bla bla bla"
+
+    # Overwriting and deleting
+    root.texts.shorts._file("bla.txt").write("new bla")
+    assert root.texts.shorts.bla_txt.read() == "new bla"
+    root.texts.shorts._delete()
+    root.texts._copy(root._dir("copy"))
+    root._close()
+
+    root = file_tree(db_path)
+    assert root.texts._dirnames == []
+    assert sorted(root.copy.texts._filenames) == ["data.bin", "unclosed.txt"]
+    handle = root.copy.texts.data_bin._handle()
+    assert pickle.loads(pickle.dumps(handle)).read("rb") == b"\x00\x01\x02"
+
+    root = file_tree(db_path, replace=True)
+    assert root._all_files == []
+
+
+def test_sqlite_in_memory():
+    root = file_tree(":memory:", kind="sqlite")
+    root._dir("a")._file("b.txt").write("bla")
+    assert root.a.b_txt.read() == "bla"
+    with pytest.raises(ValueError):
+        root.a.b_txt._handle()